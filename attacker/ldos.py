@@ -9,6 +9,7 @@ class LDoSAttacker:
         self.mem_ab = 30  # Attacker's memory occupation capability
         self.env = env
         self.type = AttackerType.LDOS
+        self.vectorized = True  # False runs the original per-port loops
 
     def reset(self):
         # The attacker can observe the information matrix in the environment:
@@ -18,7 +19,237 @@ class LDoSAttacker:
         self.mem_ability = self.num * self.mem_ab
         self.mem_remain = self.mem_ability
 
+    def save(self):
+        # Internal state captured by Env.snapshot
+        return self.con_ability, self.con_remain, self.mem_ability, self.mem_remain
+
+    def load(self, saved):
+        self.con_ability, self.con_remain, self.mem_ability, self.mem_remain = saved
+
     def step(self, defence_strategy, simulate=False):
+        if not self.vectorized:
+            return self.step_loop(defence_strategy, simulate)
+        # A single cluster is a batch of one: the kernels write through the views into env.state and env.attack_state
+        con_remain = np.array([self.con_remain], dtype=np.int64)
+        mem_remain = np.array([self.mem_remain], dtype=np.int64)
+        ports = {}
+        for key in ["port_list", "add_ser_list1", "add_ser_list2", "del_ser_list"]:
+            value = getattr(self.env, key)
+            ports[key] = np.zeros((1, max(len(value), 1)), dtype=np.int64)
+            ports[key][0, : len(value)] = value
+        old_ports = self.env.attack_state[:, 0].copy()
+        self.step_batch(
+            self.env.state[np.newaxis],
+            self.env.attack_state[np.newaxis],
+            con_remain,
+            mem_remain,
+            ports,
+            np.array([self.env.ser_num], dtype=np.int64),
+            self.env.steps_beyond_terminated,
+        )
+        self.env.attack_index.sync(
+            self.env.attack_state[:, 0],
+            np.flatnonzero(self.env.attack_state[:, 0] != old_ports),
+        )
+        # If it is a simulated execution, then the defense is executed and restored to the previous state
+        if not simulate:
+            self.con_remain = con_remain[0]
+            self.mem_remain = mem_remain[0]
+
+    def step_batch(
+        self,
+        state,
+        attack_state,
+        con_remain,
+        mem_remain,
+        ports,
+        ser_num,
+        steps_beyond_terminated=0,
+    ):
+        """
+        Attack a batch of clusters: state (n, ser_max_num, ser_ind), attack_state (n, ser_max_num, 6),
+        con_remain / mem_remain (n,) and the port bookkeeping of Defender.step_batch are updated in place.
+        """
+        n, ser_max_num = state.shape[:2]
+
+        # Changes in attacker traffic after defense actions
+        # Service attack traffic that has port changes should be recovered
+        port_list = ports["port_list"]
+        hopped = self._first_rows(attack_state[:, :, 0]) & np.any(
+            (attack_state[:, :, 0, np.newaxis] == port_list[:, np.newaxis, :])
+            & (port_list[:, np.newaxis, :] > 0),
+            axis=2,
+        )
+        con_remain += np.sum(attack_state[:, :, 4], axis=1, where=hopped)
+        mem_remain += np.sum(attack_state[:, :, 5], axis=1, where=hopped)
+        attack_state[hopped, 4:6] = 0
+
+        # Add a replica, the attack traffic needs to be allocated to half of the new replica, and a new service needs to be added in attack_state.
+        # The copied replicas are handled in the order they were created, since a copy can be copied again
+        for k in range(ports["add_ser_list1"].shape[1]):
+            port = ports["add_ser_list1"][:, k]
+            if not np.any(port):
+                break
+            b, ind = self._find_rows(attack_state, port)
+            con_tmp = (0.5 * attack_state[b, ind, 4]).astype(np.int64)
+            mem_tmp = (0.5 * attack_state[b, ind, 5]).astype(np.int64)
+            attack_state[b, ind, 4] = con_tmp
+            attack_state[b, ind, 5] = mem_tmp
+            empty = attack_state[b, :, 0] == 0
+            has_empty = np.any(empty, axis=1)
+            b, i = b[has_empty], np.argmax(empty, axis=1)[has_empty]
+            attack_state[b, i, 0] = ports["add_ser_list2"][b, k]
+            attack_state[b, i, 4] = con_tmp[has_empty]
+            attack_state[b, i, 5] = mem_tmp[has_empty]
+
+        # Deleted replicas hand their attack traffic to the first attacked service
+        for k in range(ports["del_ser_list"].shape[1]):
+            port = ports["del_ser_list"][:, k]
+            if not np.any(port):
+                break
+            b, ind = self._find_rows(attack_state, port)
+            attack_con = attack_state[b, ind, 4]
+            attack_mem = attack_state[b, ind, 5]
+            attack_state[b, ind, 4] = 0
+            attack_state[b, ind, 5] = 0
+            used = attack_state[b, :, 0] != 0
+            has_used = np.any(used, axis=1)
+            i = np.argmax(used, axis=1)
+            with np.errstate(divide="ignore"):
+                attack_state[b[has_used], i[has_used], 4] += (attack_con // ser_num[b])[
+                    has_used
+                ]
+                attack_state[b[has_used], i[has_used], 5] += (attack_mem // ser_num[b])[
+                    has_used
+                ]
+
+        # Reconnaissance phase: The attacker builds an observation matrix in the first round, and then only needs to add or delete ports and corresponding services;
+        # the defender performs port transformation, and the attacker remains silent for a round and does not attack
+        recon = np.flatnonzero(~np.any(port_list > 0, axis=1))
+        if len(recon) == 0:
+            return
+        recon_state = state[recon]
+        recon_attack_state = attack_state[recon]
+        recon_con_remain = con_remain[recon]
+        recon_mem_remain = mem_remain[recon]
+        self._reconnaissance(recon_state, recon_attack_state, steps_beyond_terminated)
+        self._allocate(
+            recon_state, recon_attack_state, recon_con_remain, recon_mem_remain
+        )
+        state[recon] = recon_state
+        attack_state[recon] = recon_attack_state
+        con_remain[recon] = recon_con_remain
+        mem_remain[recon] = recon_mem_remain
+
+    def _first_rows(self, ports):
+        # Rows holding the first occurrence of their port, the row get_attack_index resolves to
+        same = ports[:, :, np.newaxis] == ports[:, np.newaxis, :]
+        earlier = np.tri(ports.shape[1], k=-1, dtype=bool)
+        return ~np.any(same & earlier, axis=2)
+
+    def _find_rows(self, attack_state, port):
+        # Clusters whose attack_state holds the port, and the first row holding it
+        match = (attack_state[:, :, 0] == port[:, np.newaxis]) & (
+            port[:, np.newaxis] > 0
+        )
+        b = np.flatnonzero(np.any(match, axis=1))
+        return b, np.argmax(match[b], axis=1)
+
+    def _reconnaissance(self, state, attack_state, steps_beyond_terminated):
+        state_ports = state[:, :, 2]
+
+        # First delete the ports that no longer exist in the state and assign them all to 0
+        stale = (attack_state[:, :, 0] != 0) & ~np.any(
+            attack_state[:, :, 0, np.newaxis] == state_ports[:, np.newaxis, :], axis=2
+        )
+        attack_state[stale] = 0
+
+        # Add the newly added service in the state: only modify the port number, delay, and weight.
+        # The service latency is expressed by dividing the number of service connections by the number of connections that the service can carry.
+        # The latency is too small to be reflected after rounding, so it is increased by 100 times.
+        with np.errstate(divide="ignore", invalid="ignore"):
+            latency = (
+                100 * state[:, :, 1] / (state[:, :, 0] * self.env.pod_con_num)
+            ).astype(np.int64)
+        match = attack_state[:, np.newaxis, :, 0] == state_ports[:, :, np.newaxis]
+        known = (state_ports > 0) & np.any(match, axis=2)
+        new = (state_ports > 0) & ~known
+
+        # Services already observed keep their row, new services take the empty rows in order
+        empty_rows = np.argsort(attack_state[:, :, 0] != 0, axis=1, kind="stable")
+        empty_num = np.count_nonzero(attack_state[:, :, 0] == 0, axis=1)
+        rank = np.cumsum(new, axis=1) - 1
+        new &= rank < empty_num[:, np.newaxis]
+        row = np.where(
+            known,
+            np.argmax(match, axis=2),
+            np.take_along_axis(empty_rows, np.maximum(rank, 0), axis=1),
+        )
+        b, i = np.nonzero(known | new)
+        row = row[b, i]
+        attack_state[b, row, 0] = state_ports[
+            b, i
+        ]  # Service port number detected by the attacker
+        attack_state[b, row, 1] = latency[b, i]
+        # Calculating weights by delay
+        attack_state[b, row, 3] = 0.9 * attack_state[b, row, 1] + 0.1 * 100 * (
+            attack_state[b, row, 2] / (steps_beyond_terminated + 1)
+        )
+
+    def _allocate(self, state, attack_state, con_remain, mem_remain):
+        # Attack target selection: every observed port, aligned once with its service in state
+        # (state and attack_state are connected through port) and with its row in attack_state
+        attack_ports = attack_state[:, :, 0]
+        targets = attack_ports > 0
+        target_rows = np.argmax(
+            attack_ports[:, :, np.newaxis] == attack_ports[:, np.newaxis, :], axis=2
+        )
+        target_sers = np.argmax(
+            attack_ports[:, :, np.newaxis] == state[:, np.newaxis, :, 2], axis=2
+        )
+        weight_sum = np.sum(attack_state[:, :, 3], axis=1)
+        con_cap = self.env.pod_con_num
+        mem_cap = self.env.pod_mem_num
+
+        # Start the attack and distribute the attack traffic according to the port.
+        # Each target gets its weighted share of what the earlier targets left, capped by the free capacity of the service
+        attacking = con_remain > 0
+        for k in range(attack_ports.shape[1]):
+            b = np.flatnonzero(targets[:, k] & attacking)
+            if len(b) == 0:
+                continue
+            target = target_rows[b, k]
+            target_ser_num = target_sers[b, k]
+            # Number of attacks
+            attack_state[b, target, 2] += 1
+            weight = attack_state[b, target, 3]
+            pods = state[b, target_ser_num, 0]
+            with np.errstate(divide="ignore"):
+                # Number of attack connections
+                attack_con = con_remain[b] * weight // weight_sum[b]
+                # Attack memory usage
+                attack_mem = mem_remain[b] * weight // weight_sum[b]
+
+            free_con = pods * con_cap - state[b, target_ser_num, 1]
+            fit = attack_con <= free_con
+            attack_con = np.where(fit, attack_con, free_con)
+            # Fully load the attacked service when the traffic exceeds its free capacity
+            state[b, target_ser_num, 1] = np.where(
+                fit, state[b, target_ser_num, 1] + attack_con, pods * con_cap
+            )
+            attack_state[b, target, 4] += attack_con
+            con_remain[b] -= attack_con
+
+            free_mem = pods * mem_cap - state[b, target_ser_num, 3]
+            fit = attack_mem <= free_mem
+            attack_mem = np.where(fit, attack_mem, free_mem)
+            state[b, target_ser_num, 3] = np.where(
+                fit, state[b, target_ser_num, 3] + attack_mem, pods * mem_cap
+            )
+            attack_state[b, target, 5] += attack_mem
+            mem_remain[b] -= attack_mem
+
+    def step_loop(self, defence_strategy, simulate=False):
         save_con_remain = self.con_remain
         save_mem_remain = self.mem_remain
 
@@ -27,7 +258,7 @@ class LDoSAttacker:
             defence_strategy == DefenceStrategy.PORT_HOPPING
         ):  # Service attack traffic that has port changes should be recovered
             for port in self.env.port_list:
-                if port in self.env.attack_state[:, 0]:
+                if port in self.env.attack_index:
                     ind = self.env.get_attack_index(port)
                     self.con_remain += self.env.attack_state[ind][4]
                     self.mem_remain += self.env.attack_state[ind][5]
@@ -37,7 +268,7 @@ class LDoSAttacker:
             defence_strategy == DefenceStrategy.REPLICA_INCREASE
         ):  # Add a replica, the attack traffic needs to be allocated to half of the new replica, and a new service needs to be added in attack_state
             for port in self.env.add_ser_list1:
-                if port in self.env.attack_state[:, 0]:
+                if port in self.env.attack_index:
                     ind = self.env.get_attack_index(port)
                     con_tmp = 0.5 * self.env.attack_state[ind][4]
                     mem_tmp = 0.5 * self.env.attack_state[ind][5]
@@ -49,12 +280,13 @@ class LDoSAttacker:
                     for i in range(self.env.ser_max_num):
                         if self.env.attack_state[i][0] == 0:
                             self.env.attack_state[i][0] = new_port
+                            self.env.attack_index.set(i, new_port)
                             self.env.attack_state[i][4] = con_tmp
                             self.env.attack_state[i][5] = mem_tmp
                             break
         elif defence_strategy == DefenceStrategy.REPLICA_DECREASE:
             for port in self.env.del_ser_list:
-                if port in self.env.attack_state[:, 0]:
+                if port in self.env.attack_index:
                     ind = self.env.get_attack_index(port)
                     attack_con = self.env.attack_state[ind][4]
                     attack_mem = self.env.attack_state[ind][5]
@@ -77,15 +309,16 @@ class LDoSAttacker:
             for port in self.env.attack_state[
                 :, 0
             ]:  # First delete the ports that no longer exist in the state and assign them all to 0
-                if port not in self.env.state[:, 2]:
+                if port and port not in self.env.state_index:
                     ind = self.env.get_attack_index(port)
                     self.env.attack_state[ind] = np.array([0, 0, 0, 0, 0, 0])
+                    self.env.attack_index.set(ind, 0)
             for port in self.env.state[
                 :, 2
             ]:  # Add the newly added service in the state: only modify the port number, delay, and weight
-                ind_s = self.env.get_state_index(port)
                 if port > 0:
-                    if port in self.env.attack_state[:, 0]:
+                    ind_s = self.env.get_state_index(port)
+                    if port in self.env.attack_index:
                         ind = self.env.get_attack_index(port)
                         self.env.attack_state[ind][0] = self.env.state[ind_s][
                             2
@@ -108,6 +341,7 @@ class LDoSAttacker:
                         for i in range(self.env.ser_max_num):
                             if self.env.attack_state[i][0] == 0:
                                 self.env.attack_state[i][0] = self.env.state[ind_s][2]
+                                self.env.attack_index.set(i, self.env.state[ind_s][2])
                                 self.env.attack_state[i][1] = (
                                     100
                                     * self.env.state[ind_s][1]
@@ -0,0 +1,92 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+# Startup time of the CLI per decider, fails when a decider loads heavy modules it does not need
+# or starts slower than max_seconds: python bench_startup.py --repeat 5 --max_seconds 1.5
+
+HEAVY = ["torch", "openai", "pydantic", "tenacity", "pandas"]
+
+# Heavy modules every decider may load
+ALLOWED = {
+    "RANDOM": [],
+    "GREEDY": [],
+    "DISTILLED": [],
+    "LLM": ["openai", "pydantic", "tenacity", "pandas"],
+}
+
+STARTUP = """
+import sys
+import main
+from constants import check_decider_type
+from decider.decider import deciderFactory
+
+main.parse_args(
+    ["--decider_type", "{decider_type}", "--attacker_type", "LDOS", "--attacker_num", "10"]
+)
+deciderFactory(check_decider_type("{decider_type}"))
+print(__import__("json").dumps([name for name in {heavy} if name in sys.modules]))
+"""
+
+
+def startup(decider_type):
+    # Seconds to import main and create the decider in a new interpreter, and the heavy modules it loaded
+    start = time.perf_counter()
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            STARTUP.format(decider_type=decider_type, heavy=HEAVY),
+        ],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Startup of {decider_type} failed\n{result.stderr}")
+    return time.perf_counter() - start, json.loads(result.stdout.splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="argparse")
+    parser.add_argument(
+        "--decider_types",
+        type=str,
+        nargs="+",
+        required=False,
+        default=list(ALLOWED),
+        help="Deciders",
+    )
+    parser.add_argument(
+        "--repeat", type=int, required=False, default=3, help="Runs per decider"
+    )
+    parser.add_argument(
+        "--max_seconds",
+        type=float,
+        required=False,
+        default=1.5,
+        help="Max best startup time of the deciders without heavy modules",
+    )
+
+    args = parser.parse_args()
+    failed = []
+    for decider_type in args.decider_types:
+        times, loaded = zip(*(startup(decider_type) for _ in range(args.repeat)))
+        unexpected = sorted(set(loaded[0]) - set(ALLOWED.get(decider_type, HEAVY)))
+        print(
+            f"{decider_type}: best {min(times):.3f}s, median {sorted(times)[len(times) // 2]:.3f}s, "
+            f"heavy modules {loaded[0]}"
+        )
+        if unexpected:
+            failed.append(f"{decider_type} loads {unexpected}")
+        if not ALLOWED.get(decider_type) and min(times) > args.max_seconds:
+            failed.append(
+                f"{decider_type} starts in {min(times):.3f}s > {args.max_seconds}s"
+            )
+    for failure in failed:
+        print(failure)
+    if failed:
+        raise SystemExit(1)
@@ -1,5 +1,6 @@
 from enum import Enum
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
+import numpy as np
 
 
 class DefenceStrategy(Enum):
@@ -18,6 +19,7 @@ class DeciderType(Enum):
     AC = "AC"
     PPO = "PPO"
     LLM = "LLM"
+    DISTILLED = "DISTILLED"
 
 
 class AttackerType(Enum):
@@ -36,6 +38,24 @@ class Indicators:
     cost: int
 
 
+@dataclass
+class IndicatorsBatch:
+    # Indicators of a stack of service states, one array entry per state
+    C_e: np.ndarray
+    C_d: np.ndarray
+    M_e: np.ndarray
+    M_d: np.ndarray
+    con_delay: np.ndarray
+    mem_delay: np.ndarray
+    cost: np.ndarray
+
+    def __len__(self):
+        return len(self.C_e)
+
+    def __getitem__(self, i) -> Indicators:
+        return Indicators(*(getattr(self, f.name)[i] for f in fields(self)))
+
+
 map_action_to_defence = {
     0: DefenceStrategy.PORT_HOPPING,
     1: DefenceStrategy.REPLICA_INCREASE,
@@ -1,12 +1,16 @@
-import decider.random as random_decider
-import decider.llm as llm_decider
+import importlib
 from constants import DeciderType
 
+# Deciders are imported when they are created, the LLM decider loads openai, pydantic and tenacity
+decider_modules = {
+    DeciderType.LLM: "decider.llm",
+    DeciderType.RANDOM: "decider.random",
+    DeciderType.GREEDY: "decider.greedy",
+    DeciderType.DISTILLED: "decider.distilled",
+}
+
 
 def deciderFactory(decider_type):
-    if decider_type == DeciderType.LLM:
-        return llm_decider
-    elif decider_type == DeciderType.RANDOM:
-        return random_decider
-    else:
+    if decider_type not in decider_modules:
         raise ValueError("Invalid decider type")
+    return importlib.import_module(decider_modules[decider_type])
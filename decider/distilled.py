@@ -0,0 +1,208 @@
+import json
+import time
+import numpy as np
+from decider.loop import new_logger, run_title, train_loop
+from utils import judge_fail_func
+
+FEATURES = ["C_e", "C_d", "M_e", "M_d", "con_delay", "mem_delay"]
+
+
+class DistilledPolicy:
+    """
+    Tabular policy distilled from the decisions of another decider, see distill.py.
+    The indicators of the service state before a decision are quantized into buckets per feature and keyed
+    together with the last history actions of the episode. Every key keeps the number of times each action
+    was taken and how often its step succeeded, and decides on the action with the best smoothed success rate.
+    Unseen keys fall back to the same features after any recent actions and then to the nearest features.
+    """
+
+    def __init__(self, buckets=10, history=1, num_actions=6):
+        self.buckets = buckets
+        self.history = history
+        self.num_actions = num_actions
+        self.counts = (
+            {}
+        )  # (features, recent actions) -> [count, successes] of every action
+        self.table = {}
+        self.state_table = {}
+        self.state_keys = np.zeros((0, len(FEATURES)))
+        self.state_actions = []
+
+    def features(self, indicators):
+        # indicators as a dict, values of 1 and above, inf and nan go to the last bucket.
+        # Plain floats, numpy is slower for a handful of values
+        return tuple(
+            (
+                int(float(indicators[name]) * self.buckets)
+                if float(indicators[name]) < 1
+                else self.buckets
+            )
+            for name in FEATURES
+        )
+
+    def key(self, indicators, actions):
+        recent = tuple(actions[len(actions) - self.history :]) if self.history else ()
+        return self.features(indicators), recent
+
+    def fit(self, samples):
+        # samples of (indicators, actions before in the episode, action, success)
+        for indicators, actions, action, success in samples:
+            counts = self.counts.setdefault(
+                self.key(indicators, actions), [[0, 0] for _ in range(self.num_actions)]
+            )
+            counts[action][0] += 1
+            counts[action][1] += int(bool(success))
+        self.compile()
+        return self
+
+    def compile(self):
+        state_counts = {}
+        for (features, _), counts in self.counts.items():
+            merged = state_counts.setdefault(
+                features, [[0, 0] for _ in range(self.num_actions)]
+            )
+            for action, (count, successes) in enumerate(counts):
+                merged[action][0] += count
+                merged[action][1] += successes
+        self.table = {key: self.best(counts) for key, counts in self.counts.items()}
+        self.state_table = {
+            features: self.best(counts) for features, counts in state_counts.items()
+        }
+        self.state_keys = np.array(list(self.state_table), dtype=float).reshape(
+            -1, len(FEATURES)
+        )
+        self.state_actions = list(self.state_table.values())
+
+    @staticmethod
+    def best(counts):
+        # Laplace smoothed success rate, ties go to the more frequent action
+        return max(
+            range(len(counts)),
+            key=lambda a: ((counts[a][1] + 1) / (counts[a][0] + 2), counts[a][0]),
+        )
+
+    def action(self, indicators, actions):
+        features, recent = self.key(indicators, actions)
+        action = self.table.get((features, recent))
+        if action is None:
+            action = self.state_table.get(features)
+        if action is None:
+            if not self.state_actions:
+                return self.num_actions - 1  # no action
+            distances = np.abs(self.state_keys - features).sum(axis=1)
+            action = self.state_actions[int(np.argmin(distances))]
+        return action
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "buckets": self.buckets,
+                    "history": self.history,
+                    "num_actions": self.num_actions,
+                    "features": FEATURES,
+                    "counts": [
+                        [list(features), list(recent), counts]
+                        for (features, recent), counts in self.counts.items()
+                    ],
+                },
+                f,
+            )
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        policy = cls(data["buckets"], data["history"], data["num_actions"])
+        policy.counts = {
+            (tuple(features), tuple(recent)): counts
+            for features, recent, counts in data["counts"]
+        }
+        policy.compile()
+        return policy
+
+
+class Distilled:
+    def __init__(self, policy, max_fail_num=5):
+        self.policy = policy
+        self.max_fail_num = max_fail_num
+        self.actions = []
+        self.fail_num = 0
+        self.success_num = 0
+
+    def reset(self):
+        self.actions = []
+        self.fail_num = 0
+        self.success_num = 0
+
+    def take_action(self, attack_indicators, step, action_thresholds):
+        action = self.policy.action(vars(attack_indicators), self.actions)
+        self.actions.append(action)
+        con_threshold, mem_threshold = action_thresholds[action]
+        return action, con_threshold, mem_threshold
+
+    def judge(self, indicators):
+        success, fail_msg = judge_fail_func(indicators)
+        if success:
+            self.fail_num = 0
+            self.success_num += 1
+        else:
+            self.success_num = 0
+            self.fail_num += 1
+
+        finish = -1
+        if self.fail_num >= self.max_fail_num:
+            finish = 0
+        if self.success_num >= self.max_fail_num:
+            finish = 1
+        return finish, success, fail_msg
+
+
+def train_and_test(
+    env,
+    num_episodes,
+    attack_sequence,
+    max_fail_num,
+    max_episode_step=30,
+    enable_log=True,
+    prefix="default",
+    output_dir="output",
+    log_background=False,
+    log_backend="tensorboard",
+    log_flush_secs=10,
+    change_num=0,
+    policy_path="policy.json",
+):
+    logger = new_logger(
+        run_title(env, num_episodes, change_num),
+        enable_log,
+        prefix,
+        output_dir,
+        log_background,
+        log_backend,
+        log_flush_secs,
+    )
+    agent = Distilled(DistilledPolicy.load(policy_path), max_fail_num)
+    decision_times = []
+
+    def take_action(state, attack_indicators, step, action_thresholds):
+        start = time.perf_counter()
+        decision = agent.take_action(attack_indicators, step, action_thresholds)
+        decision_times.append(time.perf_counter() - start)
+        return decision
+
+    results = train_loop(
+        env,
+        agent,
+        take_action,
+        num_episodes,
+        attack_sequence,
+        max_fail_num,
+        max_episode_step,
+        change_num,
+        logger,
+    )
+    print(
+        f"decision time {sum(decision_times) / max(len(decision_times), 1) * 1e6:.1f} us"
+    )
+    return results
@@ -0,0 +1,203 @@
+import numpy as np
+from decider.loop import new_logger, run_title, train_loop, train_loop_vector
+from utils import judge_fail_func, judge_fail_batch
+
+
+class Greedy:
+    def __init__(self, max_fail_num=5, attack_sequence=None, depth=1, beam_width=3):
+        self.max_fail_num = max_fail_num
+        self.attack_sequence = attack_sequence
+        self.depth = depth  # Number of steps looked ahead
+        self.beam_width = beam_width  # Lookahead branches kept after every step
+        self.fail_num = 0
+        self.success_num = 0
+
+    def reset(self):
+        self.fail_num = 0
+        self.success_num = 0
+
+    @staticmethod
+    def score(env, defence_success, indicators, success_num, fail_num):
+        # Reward of every evaluated action and the success / failure counts it leads to,
+        # actions that leave no active replica are never chosen
+        success = judge_fail_batch(indicators)
+        success_num = np.where(success, success_num + 1, 0)
+        fail_num = np.where(success, 0, fail_num + 1)
+        reward = env.cal_reward(
+            success, defence_success, indicators, success_num, fail_num
+        )
+        valid = np.isfinite(indicators.con_delay) & np.isfinite(indicators.mem_delay)
+        return np.where(valid, reward, -np.inf), success_num, fail_num
+
+    def take_action(self, env, state, step, action_thresholds):
+        do_attack = self.attack_sequence[step % len(self.attack_sequence)]
+        _, _, defence_success, _, _, indicators = env.evaluate_actions(
+            state, action_thresholds, do_attack
+        )
+        scores, success_num, fail_num = self.score(
+            env, defence_success, indicators, self.success_num, self.fail_num
+        )
+        if self.depth > 1:
+            scores = self.beam_search(
+                env, step, action_thresholds, scores, success_num, fail_num
+            )
+        action = int(np.argmax(scores))  # ties go to the first action
+        con_threshold, mem_threshold = action_thresholds[action]
+        return action, con_threshold, mem_threshold
+
+    def beam_search(self, env, step, action_thresholds, scores, success_num, fail_num):
+        # Best total reward within depth steps after each first action.
+        # A branch is replayed from the current state with the same random numbers whenever it is extended,
+        # and branches whose episode has ended are kept as they are
+        random_state = env.rng.get_state()
+        root = env.snapshot()
+        branches = [
+            (scores[a], [a], success_num[a], fail_num[a])
+            for a in range(len(scores))
+            if np.isfinite(scores[a])
+        ]
+        for depth in range(1, self.depth):
+            branches.sort(key=lambda branch: -branch[0])
+            beam = branches[: self.beam_width]
+            branches = []
+            for score, actions, branch_success_num, branch_fail_num in beam:
+                if (
+                    branch_success_num >= self.max_fail_num
+                    or branch_fail_num >= self.max_fail_num
+                ):
+                    branches.append(
+                        (score, actions, branch_success_num, branch_fail_num)
+                    )
+                    continue
+                env.restore(root)
+                root = env.snapshot()
+                env.rng.set_state(random_state)
+                for i, action in enumerate(actions):
+                    con_percent, mem_percent = action_thresholds[action]
+                    env.step(
+                        action,
+                        {"con_percent": con_percent, "mem_percent": mem_percent},
+                        self.attack_sequence[(step + i) % len(self.attack_sequence)],
+                    )
+                _, _, defence_success, _, _, indicators = env.evaluate_actions(
+                    env.state,
+                    action_thresholds,
+                    self.attack_sequence[(step + depth) % len(self.attack_sequence)],
+                )
+                child_scores, child_success_num, child_fail_num = self.score(
+                    env,
+                    defence_success,
+                    indicators,
+                    branch_success_num,
+                    branch_fail_num,
+                )
+                branches += [
+                    (
+                        score + child_scores[a],
+                        actions + [a],
+                        child_success_num[a],
+                        child_fail_num[a],
+                    )
+                    for a in range(len(child_scores))
+                    if np.isfinite(child_scores[a])
+                ]
+        env.restore(root)
+        env.rng.set_state(random_state)
+
+        values = np.full(len(scores), -np.inf)
+        for score, actions, _, _ in branches:
+            values[actions[0]] = max(values[actions[0]], score)
+        return values if np.any(np.isfinite(values)) else scores
+
+    def judge(self, indicators):
+        success, fail_msg = judge_fail_func(indicators)
+        if success:
+            self.fail_num = 0
+            self.success_num += 1
+        else:
+            self.success_num = 0
+            self.fail_num += 1
+
+        finish = -1
+        if self.fail_num >= self.max_fail_num:
+            finish = 0
+        if self.success_num >= self.max_fail_num:
+            finish = 1
+        return finish, success, fail_msg
+
+
+def train_and_test(
+    env,
+    num_episodes,
+    attack_sequence,
+    max_fail_num,
+    max_episode_step=30,
+    enable_log=True,
+    prefix="default",
+    output_dir="output",
+    log_background=False,
+    log_backend="tensorboard",
+    log_flush_secs=10,
+    change_num=0,
+    depth=1,
+    beam_width=3,
+):
+    logger = new_logger(
+        run_title(env, num_episodes, change_num),
+        enable_log,
+        prefix,
+        output_dir,
+        log_background,
+        log_backend,
+        log_flush_secs,
+    )
+    agent = Greedy(max_fail_num, attack_sequence, depth, beam_width)
+    return train_loop(
+        env,
+        agent,
+        lambda state, attack_indicators, step, action_thresholds: agent.take_action(
+            env, state, step, action_thresholds
+        ),
+        num_episodes,
+        attack_sequence,
+        max_fail_num,
+        max_episode_step,
+        change_num,
+        logger,
+    )
+
+
+def train_and_test_vector(
+    env,
+    num_episodes,
+    max_fail_num,
+    enable_log=True,
+    prefix="default",
+    output_dir="output",
+    log_background=False,
+    log_backend="tensorboard",
+    log_flush_secs=10,
+):
+    # The actions of all clusters are scored together with one step of lookahead
+    logger = new_logger(
+        run_title(env, num_episodes, env.num_envs),
+        enable_log,
+        prefix,
+        output_dir,
+        log_background,
+        log_backend,
+        log_flush_secs,
+    )
+
+    def take_actions(state):
+        _, defence_success, _, indicators = env.evaluate_actions()
+        scores, _, _ = Greedy.score(
+            env.env,
+            defence_success,
+            indicators,
+            env.success_num[:, np.newaxis],
+            env.fail_num[:, np.newaxis],
+        )
+        return np.argmax(scores, axis=1)
+
+    return train_loop_vector(env, take_actions, num_episodes, max_fail_num, logger)
@@ -1,16 +1,27 @@
 from tqdm import tqdm
 from tenacity import retry, stop_after_attempt
+import asyncio
+import hashlib
+import json
+import os
+import threading
 import time
-from openai import OpenAI
-from pydantic import BaseModel
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+import numpy as np
+from openai import OpenAI, AsyncOpenAI
+from pydantic import BaseModel, Field
 from dataclasses import asdict
+from decider.greedy import Greedy
+from decider.loop import run_title
 from log.llm_log import LLMLogger
 from utils import get_action_thresholds, judge_fail_func
 import random
 
 
 class Action(BaseModel):
-    action: int
+    # An answer out of the actions of get_action_thresholds fails validation, so that request retries it
+    action: int = Field(ge=0, le=5)
     # con_percent: float
     # mem_percent: float
     desc: str
@@ -25,9 +36,448 @@ class Reflex(BaseModel):
     desc: str
 
 
+def count_tokens(messages):
+    # Rough estimate of the prompt tokens of messages, about 4 characters per token
+    return sum(len(message["content"]) // 4 + 4 for message in messages)
+
+
+class PromptHistory:
+    """
+    Bounds the history of the current episode that is sent with every request.
+    At least the last keep_steps steps are sent as they are and the older ones are folded into one summary message,
+    while the whole request is estimated above max_tokens fewer steps are kept, down to one.
+    Steps are folded keep_steps at a time, so that the summary and the steps after it stay the same
+    for keep_steps requests and the provider can reuse its cache of that prefix.
+    At most max_listed of the latest action sequences of earlier steps or episodes are listed in prompts.
+    None leaves the history unbounded.
+    """
+
+    def __init__(self, keep_steps=None, max_tokens=None, max_listed=None):
+        self.keep_steps = keep_steps
+        self.max_tokens = max_tokens
+        self.max_listed = max_listed
+
+    def listed(self, items):
+        return items if self.max_listed is None else items[-self.max_listed :]
+
+    def messages(self, initial, head, steps, summarize, prompts):
+        # head holds the messages of the episode before its first step
+        keep = len(steps) if self.keep_steps is None else self.keep_steps
+        while True:
+            folded = 0
+            if 0 < keep < len(steps):
+                folded = (len(steps) - keep) // keep * keep
+            messages = initial + head
+            if folded:
+                messages = messages + [summarize(folded)]
+            for step in steps[folded:]:
+                messages = messages + step
+            messages = messages + prompts
+            if (
+                self.max_tokens is None
+                or keep <= 1
+                or count_tokens(messages) <= self.max_tokens
+            ):
+                return messages
+            keep -= 1
+
+
+class DecisionCache:
+    """
+    Actions of the LLM keyed on the cluster state and the last history actions of the episode.
+    The state is quantized per active replica into its pods and the buckets of its connection and memory load rates,
+    ports and the order of the replicas are ignored. With policy "success" an action is only cached once its step
+    was judged successful and is dropped again when it fails, with "all" every decided action is cached.
+    The least recently used entries are evicted beyond max_size.
+    """
+
+    def __init__(
+        self,
+        pod_con_num,
+        pod_mem_num,
+        max_size=1024,
+        buckets=10,
+        history=2,
+        policy="success",
+    ):
+        self.pod_con_num = pod_con_num
+        self.pod_mem_num = pod_mem_num
+        self.max_size = max_size
+        self.buckets = buckets
+        self.history = history
+        self.policy = policy
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, state, actions):
+        pods = state[:, 0]
+        active = pods > 0
+        pods = pods[active]
+        con = np.minimum(
+            state[active, 1] * self.buckets // (pods * self.pod_con_num), self.buckets
+        )
+        mem = np.minimum(
+            state[active, 3] * self.buckets // (pods * self.pod_mem_num), self.buckets
+        )
+        replicas = tuple(sorted(zip(pods.tolist(), con.tolist(), mem.tolist())))
+        recent = tuple(actions[len(actions) - self.history :]) if self.history else ()
+        return replicas, recent
+
+    def get(self, key):
+        action = self.entries.get(key)
+        if action is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return action
+
+    def update(self, key, action, success):
+        if success or self.policy == "all":
+            self.entries[key] = action
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        elif self.entries.get(key) == action:
+            del self.entries[key]
+
+    def stats(self):
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+def new_cache(
+    env, cache_size=0, cache_buckets=10, cache_history=2, cache_policy="success"
+):
+    if cache_size <= 0:
+        return None
+    return DecisionCache(
+        env.pod_con_num,
+        env.pod_mem_num,
+        cache_size,
+        cache_buckets,
+        cache_history,
+        cache_policy,
+    )
+
+
+class PromptEncoding:
+    """
+    How service states and indicators are written into prompts. "full" writes the state matrix and the indicators
+    as they are. "compact" lists only the active replicas as [replica, pods, connection load rate, memory load rate]
+    without ports, writes the state after a defense as its changes to the state before it, and rounds load rates
+    and indicators to precision digits.
+    """
+
+    def __init__(self, mode="full", pod_con_num=256, pod_mem_num=100, precision=3):
+        self.mode = mode
+        self.pod_con_num = pod_con_num
+        self.pod_mem_num = pod_mem_num
+        self.precision = precision
+
+    def prompts(self):
+        # Explanation of the compact format, added to the system prompts
+        if self.mode == "full":
+            return []
+        return [
+            {
+                "role": "system",
+                "content": f"In this session the service states are written compactly. 'state' lists only the active replicas, each as [replica index, number of pods, connection load rate, memory load rate], port numbers are omitted. 'defence_state' lists only the replicas of 'state' that changed or were added by the defense and the indexes of the removed replicas, all other replicas are unchanged. 'outcomes' lists every action as [action, defence_success, success] followed by the values of its indicators in the order of 'indicators'. Load rates and indicators are rounded to {self.precision} decimals.",
+            }
+        ]
+
+    def replicas(self, state):
+        replicas = {}
+        for i, (pods, con, _, mem) in enumerate(state.tolist()):
+            if pods > 0:
+                replicas[i] = [
+                    pods,
+                    round(con / (pods * self.pod_con_num), self.precision),
+                    round(mem / (pods * self.pod_mem_num), self.precision),
+                ]
+        return replicas
+
+    def state(self, state):
+        if self.mode == "full":
+            return str(state.tolist())
+        return str([[i] + replica for i, replica in self.replicas(state).items()])
+
+    def defence_state(self, defence_state, state):
+        if self.mode == "full":
+            return str(defence_state.tolist())
+        before = self.replicas(state)
+        after = self.replicas(defence_state)
+        changed = [
+            [i] + replica for i, replica in after.items() if before.get(i) != replica
+        ]
+        removed = [i for i in before if i not in after]
+        return f"changed replicas {changed}, removed replicas {removed}"
+
+    def outcomes(self, outcomes):
+        if self.mode == "full":
+            return str(outcomes)
+        return str(
+            [
+                [
+                    outcome["action"],
+                    int(outcome["defence_success"]),
+                    int(outcome["success"]),
+                ]
+                + [
+                    round(value, self.precision)
+                    for value in outcome["indicators"].values()
+                ]
+                for outcome in outcomes
+            ]
+        )
+
+    def indicators(self, indicators):
+        if self.mode == "full":
+            return str(asdict(indicators))
+        return str(
+            {
+                key: round(float(value), self.precision)
+                for key, value in asdict(indicators).items()
+            }
+        )
+
+
+class DecisionStore:
+    """
+    Append-only JSONL store of the parsed responses of LLM requests, keyed on a fingerprint of the model,
+    the messages and the response format. In "record" mode every response is appended to the store.
+    In "replay" mode responses are served from the store and a request missing from it fails,
+    in "replay_or_call" such a request is made instead and its response is recorded.
+    The lines are also the recorded responses of llm_server.py --policy replay.
+    """
+
+    def __init__(self, path, mode="record"):
+        self.path = path
+        self.mode = mode
+        self.responses = {}  # recorded responses of every fingerprint, in order
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if mode != "record" and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self.responses.setdefault(record["fingerprint"], []).append(
+                            record["parsed"]
+                        )
+        self.file = None if mode == "replay" else open(path, "a", encoding="utf-8")
+
+    @staticmethod
+    def fingerprint(model, messages, response_format):
+        request = json.dumps(
+            {
+                "model": model,
+                "messages": messages,
+                "response_format": response_format.__name__,
+            },
+            sort_keys=True,
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+    def lookup(self, fingerprint, response_format):
+        if self.mode == "record":
+            return None
+        with self.lock:
+            responses = self.responses.get(fingerprint)
+            if not responses:
+                self.misses += 1
+                if self.mode == "replay":
+                    raise RuntimeError(
+                        f"There is no recorded response to the request {fingerprint} in {self.path}"
+                    )
+                return None
+            self.hits += 1
+            # The same request made again is answered with its next recorded response, the last one is kept
+            parsed = responses.pop(0) if len(responses) > 1 else responses[0]
+        return response_format.model_validate(parsed)
+
+    def record(self, fingerprint, model, response_format, parsed):
+        line = json.dumps(
+            {
+                "fingerprint": fingerprint,
+                "model": model,
+                "response_format": response_format.__name__,
+                "parsed": parsed.model_dump(),
+            },
+            ensure_ascii=False,
+        )
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class DeadlinePolicy:
+    """
+    Decides on a fast local policy when the LLM has not answered an action request within deadline seconds.
+    "greedy" takes the action the greedy decider scores best in the evaluated outcomes of the step, "rule" scales
+    the replicas when a load rate reaches the scaling threshold of get_action_thresholds, shrinks them when all load
+    rates are below the shrinking threshold and takes no action otherwise, "cache" takes the cached action of the same quantized state
+    after any recent actions and falls back to "greedy". The late answer of the LLM is still awaited and recorded
+    next to the fallback action, a request that has not been sent yet is cancelled.
+    """
+
+    def __init__(
+        self, deadline, fallback="greedy", env=None, pod_con_num=256, pod_mem_num=100
+    ):
+        self.deadline = deadline
+        self.fallback = fallback
+        self.env = env  # scores the outcomes with Env.cal_reward
+        self.pod_con_num = pod_con_num
+        self.pod_mem_num = pod_mem_num
+        self.records = []  # one per action request
+
+    def action(
+        self,
+        state,
+        action_thresholds,
+        evaluation,
+        cache=None,
+        cache_key=None,
+        success_num=0,
+        fail_num=0,
+    ):
+        if self.fallback == "cache" and cache is not None and cache_key is not None:
+            for key in reversed(cache.entries):
+                if key[0] == cache_key[0]:
+                    return "cache", cache.entries[key]
+        if self.fallback != "rule" and evaluation is not None:
+            action = self.greedy_action(evaluation, success_num, fail_num)
+            if action is not None:
+                return "greedy", action
+        return "rule", self.rule_action(state, action_thresholds)
+
+    def greedy_action(self, evaluation, success_num, fail_num):
+        # evaluation of Env.evaluate_actions, None when every action leaves no active replica
+        _, _, defence_success, _, _, indicators = evaluation
+        scores, _, _ = Greedy.score(
+            self.env, defence_success, indicators, success_num, fail_num
+        )
+        if not np.any(np.isfinite(scores)):
+            return None
+        return int(np.argmax(scores))
+
+    def rule_action(self, state, action_thresholds):
+        # Thresholds of 0 are not checked, as for the actions of get_action_thresholds
+        pods = state[:, 0]
+        active = pods > 0
+        con = state[active, 1] / (pods[active] * self.pod_con_num)
+        mem = state[active, 3] / (pods[active] * self.pod_mem_num)
+        scale_con, scale_mem = action_thresholds[3]
+        shrink_con, shrink_mem = action_thresholds[4]
+        if (scale_con > 0 and np.any(con >= scale_con)) or (
+            scale_mem > 0 and np.any(mem >= scale_mem)
+        ):
+            return 3
+        if np.all(con <= shrink_con) and np.all(mem <= shrink_mem):
+            return 4
+        return 5
+
+    def record(self, episode, step):
+        # Made before the request is sent, so that its answer is recorded whenever it arrives
+        record = {
+            "episode": episode,
+            "step": step,
+            "fallback": False,
+            "policy": None,
+            "fallback_action": None,
+            "llm_action": None,
+            "latency": None,
+            "error": None,
+        }
+        self.records.append(record)
+        return record
+
+    def fall_back(self, record, policy, action):
+        record["fallback"] = True
+        record["policy"] = policy
+        record["fallback_action"] = action
+
+    def cancelled(self, record):
+        record["error"] = "cancelled before it was sent"
+
+    def answered(self, record, start, parsed=None, error=None):
+        record["latency"] = time.perf_counter() - start
+        if parsed is not None:
+            record["llm_action"] = parsed.action
+        if error is not None:
+            record["error"] = repr(error)
+        if record["fallback"]:
+            print("late answer", record)
+
+    def stats(self, episode=None):
+        records = [
+            record
+            for record in self.records
+            if episode is None or record["episode"] == episode
+        ]
+        latencies = [
+            record["latency"] for record in records if record["latency"] is not None
+        ]
+        stats = {
+            "requests": len(records),
+            "fallback_rate": (
+                round(sum(record["fallback"] for record in records) / len(records), 3)
+                if records
+                else None
+            ),
+        }
+        if latencies:
+            for name, q in [("p50", 50), ("p90", 90), ("p99", 99), ("max", 100)]:
+                stats[name] = round(float(np.percentile(latencies, q)), 3)
+        return stats
+
+
+def new_deadline(env, deadline=None, fallback="greedy"):
+    if deadline is None:
+        return None
+    return DeadlinePolicy(deadline, fallback, env, env.pod_con_num, env.pod_mem_num)
+
+
+def client_options(base_url=None):
+    # A local OpenAI compatible server, e.g. llm_server.py, does not need an API key
+    if base_url is None:
+        return {}
+    return {"base_url": base_url, "api_key": os.environ.get("OPENAI_API_KEY", "local")}
+
+
 class LLM:
-    def __init__(self, num_episodes, max_fail_num=5):
-        self.client = OpenAI()
+    def __init__(
+        self,
+        num_episodes,
+        max_fail_num=5,
+        client=None,
+        reflection="background",
+        history=None,
+        cache=None,
+        encoding=None,
+        model="gpt-4o-mini",
+        base_url=None,
+        store=None,
+        deadline=None,
+        rng=None,
+    ):
+        self.model = model
+        self.base_url = base_url
+        self.client = (
+            client  # created on the first request, replayed runs need no API key
+        )
+        self.client_lock = threading.Lock()
+        self.store = store
         self.inital_prompts = [
             {
                 "role": "system",
@@ -100,6 +550,9 @@ class LLM:
                 """,
             },
         ]
+        self.encoding = PromptEncoding() if encoding is None else encoding
+        self.inital_prompts += self.encoding.prompts()
+        self.step_state = None  # state at the start of the current step
         self.episode = 0
         self.num_episodes = num_episodes
         self.explore_x = -1
@@ -118,18 +571,246 @@ class LLM:
         self.max_fail_num = max_fail_num
         self.step_actions = []
         self.step_fail_actions = []
+        # The answers to step reflections are not used, so their requests are either made before the next step ("sync"),
+        # made in the background and waited for before the next episode reflection ("background"), or not made ("skip")
+        self.reflection = reflection
+        self.pending_reflections = []
+        self.executor = None
+        self.action_executor = None  # action requests, apart from the reflections
+        self.history = PromptHistory() if history is None else history
+        self.step_starts = []  # index in prompts of the first message of every step
+        self.step_fail_nums = []  # number of failed step sequences before every step
+        self.token_counts = []  # size of every request
+        self.last_messages = []  # messages of the previous request
+        self.cache = cache
+        self.cache_key = None  # key of the state of the current step in the cache
+        self.deadline = deadline
+        self.pending_answers = []  # requests of actions that missed the deadline
+        self.journal = None
+        self.system_hash = None
+        self.rng = (
+            random if rng is None else rng
+        )  # e.g. a random.Random of its own per concurrent run
+
+    def attach_journal(self, journal):
+        # Messages and answered requests are written to the PromptJournal as they come
+        self.journal = journal
+        self.system_hash = journal.system(self.inital_prompts)
+
+    def add_prompts(self, prompts):
+        if self.journal is not None:
+            for index, message in enumerate(prompts, len(self.prompts)):
+                self.journal.message(self.episode, index, message)
+        self.prompts += prompts
+
+    def new_client(self):
+        return OpenAI(**client_options(self.base_url))
+
+    def get_client(self):
+        # Requests also come from the threads of submit, only one of them creates the client
+        with self.client_lock:
+            if self.client is None:
+                self.client = self.new_client()
+            return self.client
+
+    def parse(self, messages, response_format, tokens):
+        start = time.perf_counter()
+        fingerprint = None
+        parsed = None
+        if self.store is not None:
+            fingerprint = self.store.fingerprint(self.model, messages, response_format)
+            parsed = self.store.lookup(fingerprint, response_format)
+            tokens["replayed"] = parsed is not None
+        if parsed is None:
+            parsed = self.request(messages, response_format, tokens)
+            if self.store is not None:
+                self.store.record(fingerprint, self.model, response_format, parsed)
+        self.record_call(tokens, start, parsed)
+        return parsed
+
+    def record_call(self, tokens, start, parsed):
+        tokens["latency"] = time.perf_counter() - start
+        if self.journal is not None:
+            self.journal.call(tokens, self.system_hash, parsed.model_dump())
+
+    def call_scalars(self, episode):
+        # Logged scalars of the requests of an episode, requests still running have no latency yet
+        calls = [tokens for tokens in self.token_counts if tokens["episode"] == episode]
+        latencies = [
+            tokens["latency"] for tokens in calls if tokens["latency"] is not None
+        ]
+        scalars = {
+            "llm_calls": len(calls),
+            "llm_estimated_tokens": sum(tokens["estimated_tokens"] for tokens in calls),
+        }
+        if latencies:
+            scalars["llm_latency"] = sum(latencies) / len(latencies)
+            scalars["llm_max_latency"] = max(latencies)
+        return scalars
+
+    @retry(stop=stop_after_attempt(3))
+    def request(self, messages, response_format, tokens):
+        completion = self.get_client().beta.chat.completions.parse(
+            model=self.model,
+            messages=messages,
+            response_format=response_format,
+            timeout=30,
+        )
+        self.count_usage(tokens, completion)
+        return completion.choices[0].message.parsed
+
+    def messages(self, prompts):
+        # The messages of a request, with the history of the episode bounded by self.history
+        starts = self.step_starts
+        head = self.prompts[: starts[0]] if starts else self.prompts
+        steps = [
+            self.prompts[start:end]
+            for start, end in zip(starts, starts[1:] + [len(self.prompts)])
+        ]
+        return self.history.messages(
+            self.inital_prompts, head, steps, self.summarize_steps, prompts
+        )
+
+    def summarize_steps(self, step_num):
+        # Only depends on the folded steps, so it stays the same while no further steps are folded
+        step_fail_actions = self.step_fail_actions[: self.step_fail_nums[step_num]]
+        return {
+            "role": "user",
+            "content": f"Summary of steps 0 to {step_num - 1} of this episode: the actions taken were {str(self.actions[:step_num])}, whether each defense action was successful was {str(self.defence_successes[:step_num])}, and whether each defense was successful was {str(self.successes[:step_num])}. The failed action sequences of these steps are {str(self.history.listed(step_fail_actions))}.",
+        }
+
+    def count_tokens(self, call, messages):
+        # The prefix is the part of the request that repeats the previous request,
+        # which the provider can serve from its prompt cache
+        prefix = 0
+        for previous, message in zip(self.last_messages, messages):
+            if previous != message:
+                break
+            prefix += 1
+        self.last_messages = messages
+        tokens = {
+            "episode": self.episode,
+            "step": len(self.actions),
+            "call": call,
+            "messages": len(messages),
+            "estimated_tokens": count_tokens(messages),
+            "prefix_messages": prefix,
+            "prefix_tokens": count_tokens(messages[:prefix]),
+            "prompt_tokens": None,
+            "cached_tokens": None,
+            "completion_tokens": None,
+            "latency": None,
+        }
+        self.token_counts.append(tokens)
+        return tokens
+
+    def count_usage(self, tokens, completion):
+        usage = getattr(completion, "usage", None)
+        if usage is not None:
+            tokens["prompt_tokens"] = usage.prompt_tokens
+            tokens["completion_tokens"] = usage.completion_tokens
+            details = getattr(usage, "prompt_tokens_details", None)
+            tokens["cached_tokens"] = getattr(details, "cached_tokens", None)
+        print("tokens", tokens)
+
+    def cached_action(self, state):
+        self.cache_key = None
+        if self.cache is None:
+            return None
+        self.cache_key = self.cache.key(state, self.actions)
+        action = self.cache.get(self.cache_key)
+        if action is None:
+            return None
+        print("cached action", action)
+        return Action(
+            action=action,
+            desc="the same action was successful in a similar service state before",
+        )
 
     def reset(self):
         self.prompts = []
+        self.step_starts = []
+        self.step_fail_nums = []
         self.fail_num = 0
         self.success_num = 0
         self.step_actions = []
         self.step_fail_actions = []
         self.take_best_action = False
 
-    @retry(stop=stop_after_attempt(3))
-    def take_action(self, state, attack_indicators, step, action_thresholds):
+    def take_action(
+        self, state, attack_indicators, step, action_thresholds, evaluation=None
+    ):
+        prompts = self.action_prompts(state, step, evaluation)
+        parsed = self.cached_action(state)
+        if parsed is None:
+            messages = self.messages(prompts)
+            tokens = self.count_tokens("action", messages)
+            if self.deadline is None:
+                parsed = self.parse(messages, Action, tokens)
+            else:
+                record = self.deadline.record(self.episode, len(self.actions))
+                future = self.submit_action(
+                    self.answer_action, record, time.perf_counter(), messages, tokens
+                )
+                wait([future], timeout=self.deadline.deadline)
+                parsed = self.deadline_action(
+                    future, record, state, action_thresholds, evaluation
+                )
+        return self.apply_action(prompts, parsed, action_thresholds)
+
+    def answer_action(self, record, start, messages, tokens):
+        # The action request of a deadline, its answer is recorded before the future is done
+        try:
+            parsed = self.parse(messages, Action, tokens)
+        except Exception as error:
+            self.deadline.answered(record, start, error=error)
+            raise
+        self.deadline.answered(record, start, parsed)
+        return parsed
+
+    def submit_action(self, fn, *args):
+        # Action requests do not queue behind the reflections
+        if self.action_executor is None:
+            self.action_executor = ThreadPoolExecutor(max_workers=4)
+        return self.action_executor.submit(fn, *args)
+
+    def deadline_action(self, future, record, state, action_thresholds, evaluation):
+        # The answer of the request in future if it is done, otherwise the action of the fallback policy.
+        # future is a concurrent or an asyncio future of answer_action
+        if future.done() and future.exception() is None:
+            return future.result()
+        policy, action = self.deadline.action(
+            state,
+            action_thresholds,
+            evaluation,
+            self.cache,
+            self.cache_key,
+            self.success_num,
+            self.fail_num,
+        )
+        print("fallback action", policy, action)
+        self.deadline.fall_back(record, policy, action)
+        # A request still queued is not needed anymore, one already sent is awaited for its record
+        if self.cancel_action(future):
+            self.deadline.cancelled(record)
+        elif not future.done():
+            self.pending_answers.append(future)
+        return Action(
+            action=action,
+            desc=f"no answer was available within the deadline of {self.deadline.deadline} seconds, so the action of the {policy} fallback policy was taken",
+        )
+
+    def cancel_action(self, future):
+        # Only succeeds while the request waits for a thread of action_executor
+        return future.cancel()
+
+    def wait_answers(self):
+        pending, self.pending_answers = self.pending_answers, []
+        wait(pending)
+
+    def action_prompts(self, state, step, evaluation=None):
         print("action")
+        self.step_state = state
 
         best_actions = None
         if self.take_best_action:
@@ -142,20 +823,25 @@ class LLM:
         prompts = [
             {
                 "role": "user",
-                "content": f"At the start of step {step}, the current defense service state is 'state': {str(state.tolist())}, and the action sequence taken in this step is 'cur_actions': {str(self.actions)}.",
+                "content": f"At the start of step {step}, the current defense service state is 'state': {self.encoding.state(state)}, and the action sequence taken in this step is 'cur_actions': {str(self.actions)}.",
             },
+        ]
+        if evaluation is not None:
+            prompts += [
+                {
+                    "role": "user",
+                    "content": f"The simulated outcome of every action in the current state is 'outcomes': {self.encoding.outcomes(outcome_table(evaluation))}. Each element gives the action, whether its execution succeeds ('defence_success'), whether the defense succeeds ('success') and the evaluation indicators after the defense ('indicators'), so there is no need to compute them yourself.",
+                },
+            ]
+        prompts += [
             {
                 "role": "assistant",
                 "content": f"[Decision] In the current service state state, predict whether the load rates have reached the danger threshold. Which defense action 'action' should the defender take to successfully defend against the attack in this step, while minimizing resource utilization indicators? Please provide an explanation for the choice 'desc'. {'The optimal action to consider for this step is ' + str(best_actions[step % len(best_actions)]) if best_actions else ''}.",
             },
         ]
-        completion = self.client.beta.chat.completions.parse(
-            model="gpt-4o-mini",
-            messages=self.inital_prompts + self.prompts + prompts,
-            response_format=Action,
-            timeout=30,
-        )
-        parsed = completion.choices[0].message.parsed
+        return prompts
+
+    def apply_action(self, prompts, parsed, action_thresholds):
         action = parsed.action
         con_percent, mem_percent = action_thresholds[action]
         self.actions.append(action)
@@ -165,7 +851,9 @@ class LLM:
                 "content": f"The defense action to be taken in this step is {action}, with the connection load rate threshold set to {con_percent} and the memory usage threshold set to {mem_percent}. The reason for this decision is {parsed.desc}.",
             }
         ]
-        self.prompts += prompts
+        self.step_starts.append(len(self.prompts))
+        self.step_fail_nums.append(len(self.step_fail_actions))
+        self.add_prompts(prompts)
         # return parsed.action, parsed.con_percent, parsed.mem_percent
         return action, con_percent, mem_percent
 
@@ -174,6 +862,8 @@ class LLM:
         success, fail_msg = judge_fail_func(indicators)
         self.defence_successes.append(defence_success)
         self.successes.append(success)
+        if self.cache_key is not None:
+            self.cache.update(self.cache_key, self.actions[-1], success)
 
         if success:
             self.fail_num = 0
@@ -192,7 +882,7 @@ class LLM:
         prompts = [
             {
                 "role": "user",
-                "content": f"The defense action was {'successful' if defence_success else ('failed, reason: ' + defence_fail_msg) + ' and other actions may be needed in the next step.'}. The service state after execution is 'defence_state': {str(defence_state.tolist())}, and the evaluation indicators obtained are 'indicators': {asdict(indicators)}.",
+                "content": f"The defense action was {'successful' if defence_success else ('failed, reason: ' + defence_fail_msg) + ' and other actions may be needed in the next step.'}. The service state after execution is 'defence_state': {self.encoding.defence_state(defence_state, self.step_state)}, and the evaluation indicators obtained are 'indicators': {self.encoding.indicators(indicators)}.",
             },
             {
                 "role": "assistant",
@@ -206,11 +896,39 @@ class LLM:
             }
         ]
 
-        self.prompts += prompts
+        self.add_prompts(prompts)
         return finish, success, fail_msg
 
-    @retry(stop=stop_after_attempt(3))
     def reflex_step(self, action, step):
+        prompts = self.step_reflection_prompts(action)
+        if prompts is None:
+            return
+        messages = self.messages(prompts)
+        self.add_prompts(prompts)
+        if self.reflection == "sync":
+            self.parse(messages, Reflex, self.count_tokens("step_reflection", messages))
+        elif self.reflection == "background":
+            self.pending_reflections.append(
+                self.submit(
+                    self.parse,
+                    messages,
+                    Reflex,
+                    self.count_tokens("step_reflection", messages),
+                )
+            )
+
+    def submit(self, fn, *args):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=4)
+        return self.executor.submit(fn, *args)
+
+    def wait_reflections(self):
+        pending, self.pending_reflections = self.pending_reflections, []
+        for future in pending:
+            future.result()
+
+    def step_reflection_prompts(self, action):
+        # None while the steps since the last reflection have not failed
         some_steps_fail = self.success_num == 0
         repeated_fail_actions = True
         if len(self.step_fail_actions) == 0:
@@ -229,7 +947,7 @@ class LLM:
         if some_steps_fail:
             print("reflex certain steps")
             if repeated_fail_actions:
-                prompt = f"[Step Reflection] The defenses in these steps ultimately ended in failure. The sequence of defense actions was {cur_actions}, which repeats a previous failed action sequence. All previous failed action sequences are {str(self.step_fail_actions)}. Be sure to avoid repeating the failed action sequences and make better defense decisions!"
+                prompt = f"[Step Reflection] The defenses in these steps ultimately ended in failure. The sequence of defense actions was {cur_actions}, which repeats a previous failed action sequence. All previous failed action sequences are {str(self.history.listed(self.step_fail_actions))}. Be sure to avoid repeating the failed action sequences and make better defense decisions!"
             else:
                 prompt = f"[Step Reflection] The defenses in these steps ultimately ended in failure. The sequence of defense actions was {cur_actions}. Please reflect on the failure experiences and try to improve the defense measures in the next rounds."
 
@@ -240,18 +958,20 @@ class LLM:
                 },
             ]
 
-            completion = self.client.beta.chat.completions.parse(
-                model="gpt-4o-mini",
-                messages=self.inital_prompts + self.prompts + prompts,
-                response_format=Reflex,
-                timeout=30,
-            )
-            parsed = completion.choices[0].message.parsed
             print("step fail actions", cur_actions, self.step_fail_actions)
-            self.prompts += prompts
+            return prompts
+        return None
 
-    @retry(stop=stop_after_attempt(3))
     def reflex_ep(self, step_num, success, episode):
+        self.wait_reflections()
+        prompts = self.episode_reflection_prompts(step_num, success, episode)
+        messages = self.messages(prompts)
+        parsed = self.parse(
+            messages, Reflex, self.count_tokens("episode_reflection", messages)
+        )
+        self.apply_episode_reflection(prompts, parsed)
+
+    def episode_reflection_prompts(self, step_num, success, episode):
         print("reflex per episode")
         self.episode = episode
         fail_msg = (
@@ -296,7 +1016,7 @@ class LLM:
                 }
                 for i in range(len(a["actions"]))
             ]
-            for a in self.ep_success_actions
+            for a in self.history.listed(self.ep_success_actions)
         ]
 
         x = (
@@ -307,7 +1027,7 @@ class LLM:
         self.explore_rate += x
         print("explore rate", episode, self.explore_rate)
         best_actions = None
-        if self.best_ep_actions and (random.random() < self.explore_rate):
+        if self.best_ep_actions and (self.rng.random() < self.explore_rate):
             best_actions = self.best_ep_actions["actions"]
             self.take_best_action = True
         else:
@@ -322,21 +1042,16 @@ class LLM:
             },
             {
                 "role": "user",
-                "content": f"In the previous episode, { 'the failed actions from earlier episodes were repeated' if repeated_fail_actions else 'the failed actions from earlier episodes were not repeated' }. So far, the list of all failed defense actions across episodes is 'fail_actions': {str(self.ep_fail_actions)}. Please avoid repeating these actions in the current episode! Additionally, the list of all successful defense actions across episodes is 'success_actions': {str(zip_ep_success_actions)}.",
+                "content": f"In the previous episode, { 'the failed actions from earlier episodes were repeated' if repeated_fail_actions else 'the failed actions from earlier episodes were not repeated' }. So far, the list of all failed defense actions across episodes is 'fail_actions': {str(self.history.listed(self.ep_fail_actions))}. Please avoid repeating these actions in the current episode! Additionally, the list of all successful defense actions across episodes is 'success_actions': {str(zip_ep_success_actions)}.",
             },
             {
                 "role": "assistant",
                 "content": f"[Episode Reflection] After reflecting on the previous episode of the attack-defense process, we are currently in episode {episode}. {'In this episode, please plan a sequence of actions different from the previously successful action sequences and explore whether there is a better action sequence to achieve defense success in fewer steps.' if best_actions else ('In this episode, you can directly choose the optimal action sequence from previous episodes! The optimal action sequence to consider is: ' + str(best_actions))}.",
             },
         ]
-        completion = self.client.beta.chat.completions.parse(
-            model="gpt-4o-mini",
-            messages=self.inital_prompts + self.prompts + prompts,
-            response_format=Reflex,
-            timeout=30,
-        )
-        parsed = completion.choices[0].message.parsed
+        return prompts
 
+    def apply_episode_reflection(self, prompts, parsed):
         prompts += [
             {
                 "role": "assistant",
@@ -346,38 +1061,154 @@ class LLM:
         self.actions = []
         self.successes = []
         self.defence_successes = []
-        self.prompts += prompts
+        self.add_prompts(prompts)
 
 
-def train_and_test(
+class AsyncLLM(LLM):
+    # The LLM agent with awaited requests, so that the agents of concurrent runs share one AsyncOpenAI client.
+    # Every agent keeps its own prompt history, the semaphore bounds the requests in flight across all of them
+    def __init__(self, *args, semaphore=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.semaphore = asyncio.Semaphore(1) if semaphore is None else semaphore
+
+    def new_client(self):
+        return AsyncOpenAI(**client_options(self.base_url))
+
+    async def parse(self, messages, response_format, tokens):
+        start = time.perf_counter()
+        fingerprint = None
+        parsed = None
+        if self.store is not None:
+            fingerprint = self.store.fingerprint(self.model, messages, response_format)
+            parsed = self.store.lookup(fingerprint, response_format)
+            tokens["replayed"] = parsed is not None
+        if parsed is None:
+            parsed = await self.request(messages, response_format, tokens)
+            if self.store is not None:
+                self.store.record(fingerprint, self.model, response_format, parsed)
+        self.record_call(tokens, start, parsed)
+        return parsed
+
+    @retry(stop=stop_after_attempt(3))
+    async def request(self, messages, response_format, tokens):
+        client = self.get_client()
+        async with self.semaphore:
+            completion = await client.beta.chat.completions.parse(
+                model=self.model,
+                messages=messages,
+                response_format=response_format,
+                timeout=30,
+            )
+        self.count_usage(tokens, completion)
+        return completion.choices[0].message.parsed
+
+    async def take_action(
+        self, state, attack_indicators, step, action_thresholds, evaluation=None
+    ):
+        prompts = self.action_prompts(state, step, evaluation)
+        parsed = self.cached_action(state)
+        if parsed is None:
+            messages = self.messages(prompts)
+            tokens = self.count_tokens("action", messages)
+            if self.deadline is None:
+                parsed = await self.parse(messages, Action, tokens)
+            else:
+                record = self.deadline.record(self.episode, len(self.actions))
+                task = asyncio.create_task(
+                    self.answer_action(record, time.perf_counter(), messages, tokens)
+                )
+                await asyncio.wait([task], timeout=self.deadline.deadline)
+                parsed = self.deadline_action(
+                    task, record, state, action_thresholds, evaluation
+                )
+        return self.apply_action(prompts, parsed, action_thresholds)
+
+    async def answer_action(self, record, start, messages, tokens):
+        try:
+            parsed = await self.parse(messages, Action, tokens)
+        except Exception as error:
+            self.deadline.answered(record, start, error=error)
+            raise
+        self.deadline.answered(record, start, parsed)
+        return parsed
+
+    def cancel_action(self, future):
+        # The task has started while the deadline was awaited, cancelling it would drop the request already sent
+        return False
+
+    async def reflex_step(self, action, step):
+        prompts = self.step_reflection_prompts(action)
+        if prompts is None:
+            return
+        messages = self.messages(prompts)
+        self.add_prompts(prompts)
+        if self.reflection == "sync":
+            await self.parse(
+                messages, Reflex, self.count_tokens("step_reflection", messages)
+            )
+        elif self.reflection == "background":
+            self.pending_reflections.append(
+                asyncio.create_task(
+                    self.parse(
+                        messages,
+                        Reflex,
+                        self.count_tokens("step_reflection", messages),
+                    )
+                )
+            )
+
+    async def wait_reflections(self):
+        pending, self.pending_reflections = self.pending_reflections, []
+        await asyncio.gather(*pending)
+
+    async def wait_answers(self):
+        # Their errors are already recorded by answer_action
+        pending, self.pending_answers = self.pending_answers, []
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    async def reflex_ep(self, step_num, success, episode):
+        await self.wait_reflections()
+        prompts = self.episode_reflection_prompts(step_num, success, episode)
+        messages = self.messages(prompts)
+        parsed = await self.parse(
+            messages, Reflex, self.count_tokens("episode_reflection", messages)
+        )
+        self.apply_episode_reflection(prompts, parsed)
+
+
+def outcome_table(evaluation):
+    # The outcomes of Env.evaluate_actions as one entry per action for the prompt
+    _, _, defence_success, _, _, indicators = evaluation
+    return [
+        {
+            "action": action,
+            "defence_success": bool(defence_success[action]),
+            "success": judge_fail_func(indicators[action])[0],
+            "indicators": {
+                key: round(float(value), 3)
+                for key, value in asdict(indicators[action]).items()
+            },
+        }
+        for action in range(len(defence_success))
+    ]
+
+
+def train_loop(
     env,
+    agent,
     num_episodes,
     attack_sequence,
     max_fail_num,
     max_episode_step=30,
-    enable_log=True,
-    prefix="default",
     change_num=0,
+    logger=None,
+    desc="",
 ):
-    timestamp = time.strftime("%Y%m%d-%H%M%S")
-    title = (
-        env.attacker.type.value
-        + "-"
-        + str(env.attacker.num)
-        + "-"
-        + str(num_episodes)
-        + "-"
-        + str(change_num)
-        + "-"
-        + "("
-        + timestamp
-        + ")"
-    )
-    if enable_log:
-        logger = LLMLogger(prefix, title)
-
-    agent = LLM(num_episodes, max_fail_num)
-
+    """
+    The episodes of a run as a generator shared by LLM and AsyncLLM. Every request of the agent is yielded
+    and the loop resumes with its result: run_sync sends the results of LLM straight back,
+    run_async awaits the coroutines of AsyncLLM first.
+    """
     for_step = 0
     for_episode_success = False
 
@@ -398,18 +1229,19 @@ def train_and_test(
         episode_success = []
 
         if episode != 0:
-            agent.reflex_ep(for_step, for_episode_success, episode)
+            yield agent.reflex_ep(for_step, for_episode_success, episode)
         elif change_num != 0 and episode == num_episodes - 1:
             env.change_attacker_num(change_num)
 
-        with tqdm(total=max_steps, desc=f"iteration {episode}") as pbar:
+        with tqdm(total=max_steps, desc=f"{desc}iteration {episode}") as pbar:
             while finish == -1:
                 print(f"\nstep {step}")
                 do_attack = attack_sequence[step % attack_len]
                 action_thresholds = get_action_thresholds(env.attacker.type)
                 attack_indicators = env.cal_indicators(state)
-                action, con_percent, mem_percent = agent.take_action(
-                    state, attack_indicators, step, action_thresholds
+                evaluation = env.evaluate_actions(state, action_thresholds, do_attack)
+                action, con_percent, mem_percent = yield agent.take_action(
+                    state, attack_indicators, step, action_thresholds, evaluation
                 )
                 print(
                     "action_msg",
@@ -434,6 +1266,8 @@ def train_and_test(
                 finish, success, fail_msg = agent.judge_fail(
                     defence_state, defence_success, defence_fail_msg, defence_indicators
                 )
+                if logger is not None:
+                    logger.write_step(success, defence_success, defence_indicators)
                 print(
                     "defence_msg",
                     defence_success,
@@ -443,7 +1277,7 @@ def train_and_test(
 
                 episode_success.append(success)
 
-                agent.reflex_step(action, step)
+                yield agent.reflex_step(action, step)
 
                 step += 1
                 max_steps = max(max_steps, step)
@@ -493,12 +1327,29 @@ def train_and_test(
         print(
             f"The {episode} episode has ended, with a total of {for_step} attack-defense cycles. The defense in this episode was {'successful' if for_episode_success else 'failed'}."
         )
+        if agent.cache is not None:
+            print("decision cache", agent.cache.stats())
+        if agent.deadline is not None:
+            print("deadline", agent.deadline.stats(episode))
 
-        if enable_log:
+        if logger is not None:
             logger.write_txt(episode, txt_datas)
-            logger.write_prompts(episode, agent.prompts)
+            logger.write_episode(
+                episode,
+                {
+                    "survival_rate": survival_rate[-1],
+                    "success_list": success_list[-1],
+                    "step_num_list": step_num_list[-1],
+                    **agent.call_scalars(episode),
+                },
+            )
 
-    if enable_log:
+    yield agent.wait_reflections()
+    yield agent.wait_answers()
+    if logger is not None:
+        logger.write_tokens(agent.token_counts)
+        if agent.deadline is not None:
+            logger.write_deadline(agent.deadline.records)
         logger.write_log(
             num_episodes,
             survival_rate,
@@ -514,3 +1365,264 @@ def train_and_test(
         success_list,
         step_num_list,
     )
+
+
+def run_sync(loop):
+    result = None
+    while True:
+        try:
+            result = loop.send(result)
+        except StopIteration as stop:
+            return stop.value
+
+
+async def run_async(loop):
+    result = None
+    while True:
+        try:
+            request = loop.send(result)
+        except StopIteration as stop:
+            return stop.value
+        result = await request
+
+
+def train_and_test(
+    env,
+    num_episodes,
+    attack_sequence,
+    max_fail_num,
+    max_episode_step=30,
+    enable_log=True,
+    prefix="default",
+    output_dir="output",
+    log_background=False,
+    log_backend="tensorboard",
+    log_flush_secs=10,
+    change_num=0,
+    reflection="background",
+    history_steps=None,
+    max_prompt_tokens=None,
+    max_listed_actions=None,
+    cache_size=0,
+    cache_buckets=10,
+    cache_history=2,
+    cache_policy="success",
+    encoding="full",
+    model="gpt-4o-mini",
+    base_url=None,
+    store_path=None,
+    store_mode="record",
+    deadline=None,
+    fallback="greedy",
+):
+    logger = None
+    if enable_log:
+        logger = LLMLogger(
+            prefix,
+            run_title(env, num_episodes, change_num),
+            output_dir=output_dir,
+            background=log_background,
+            backend=log_backend,
+            flush_secs=log_flush_secs,
+        )
+
+    history = PromptHistory(history_steps, max_prompt_tokens, max_listed_actions)
+    cache = new_cache(env, cache_size, cache_buckets, cache_history, cache_policy)
+    agent = LLM(
+        num_episodes,
+        max_fail_num,
+        reflection=reflection,
+        history=history,
+        cache=cache,
+        encoding=PromptEncoding(encoding, env.pod_con_num, env.pod_mem_num),
+        model=model,
+        base_url=base_url,
+        store=None if store_path is None else DecisionStore(store_path, store_mode),
+        deadline=new_deadline(env, deadline, fallback),
+    )
+    if enable_log:
+        agent.attach_journal(logger.journal)
+
+    results = run_sync(
+        train_loop(
+            env,
+            agent,
+            num_episodes,
+            attack_sequence,
+            max_fail_num,
+            max_episode_step,
+            change_num,
+            logger,
+        )
+    )
+    if agent.store is not None:
+        print("decision store", agent.store.stats())
+        agent.store.close()
+    return results
+
+
+async def train_and_test_async(
+    env,
+    agent,
+    num_episodes,
+    attack_sequence,
+    max_fail_num,
+    max_episode_step=30,
+    enable_log=True,
+    prefix="default",
+    output_dir="output",
+    log_background=False,
+    log_backend="tensorboard",
+    log_flush_secs=10,
+    change_num=0,
+    run=0,
+):
+    logger = None
+    if enable_log:
+        logger = LLMLogger(
+            prefix,
+            run_title(env, num_episodes, change_num) + "-" + str(run),
+            output_dir=output_dir,
+            background=log_background,
+            backend=log_backend,
+            flush_secs=log_flush_secs,
+        )
+        agent.attach_journal(logger.journal)
+
+    return await run_async(
+        train_loop(
+            env,
+            agent,
+            num_episodes,
+            attack_sequence,
+            max_fail_num,
+            max_episode_step,
+            change_num,
+            logger,
+            f"run {run} ",
+        )
+    )
+
+
+async def train_and_test_concurrent_async(
+    envs,
+    num_episodes,
+    max_fail_num,
+    max_concurrency=8,
+    agent_options=None,
+    cache_options=None,
+    base_url=None,
+    deadline_options=None,
+    **kwargs,
+):
+    store = (agent_options or {}).get("store")
+    client = None  # a replayed run makes no requests
+    if store is None or store.mode != "replay":
+        client = AsyncOpenAI(**client_options(base_url))
+    semaphore = asyncio.Semaphore(max_concurrency)
+    # Every run draws from random states of its own, seeded from the global state,
+    # so seeded concurrent runs are reproducible however they interleave, e.g. with a replayed store
+    seeds = np.random.randint(2**31, size=len(envs))
+    for env, seed in zip(envs, seeds):
+        env.use_rng(np.random.RandomState(seed))
+    try:
+        return await asyncio.gather(
+            *(
+                train_and_test_async(
+                    env,
+                    AsyncLLM(
+                        num_episodes,
+                        max_fail_num,
+                        client,
+                        cache=new_cache(env, **(cache_options or {})),
+                        deadline=new_deadline(env, **(deadline_options or {})),
+                        semaphore=semaphore,
+                        rng=random.Random(int(seeds[run])),
+                        **(agent_options or {}),
+                    ),
+                    num_episodes,
+                    max_fail_num=max_fail_num,
+                    run=run,
+                    **kwargs,
+                )
+                for run, env in enumerate(envs)
+            )
+        )
+    finally:
+        if client is not None:
+            await client.close()
+
+
+def train_and_test_concurrent(
+    envs,
+    num_episodes,
+    attack_sequence,
+    max_fail_num,
+    max_episode_step=30,
+    enable_log=True,
+    prefix="default",
+    output_dir="output",
+    log_background=False,
+    log_backend="tensorboard",
+    log_flush_secs=10,
+    change_num=0,
+    max_concurrency=8,
+    reflection="background",
+    history_steps=None,
+    max_prompt_tokens=None,
+    max_listed_actions=None,
+    cache_size=0,
+    cache_buckets=10,
+    cache_history=2,
+    cache_policy="success",
+    encoding="full",
+    model="gpt-4o-mini",
+    base_url=None,
+    store_path=None,
+    store_mode="record",
+    deadline=None,
+    fallback="greedy",
+):
+    # One independent run of train_and_test per environment, all runs wait on their requests concurrently
+    # over one connection pool, returns the results of every run. The runs share one decision store
+    store = None if store_path is None else DecisionStore(store_path, store_mode)
+    results = asyncio.run(
+        train_and_test_concurrent_async(
+            envs,
+            num_episodes,
+            max_fail_num,
+            max_concurrency,
+            {
+                "reflection": reflection,
+                "history": PromptHistory(
+                    history_steps, max_prompt_tokens, max_listed_actions
+                ),
+                "encoding": PromptEncoding(
+                    encoding, envs[0].pod_con_num, envs[0].pod_mem_num
+                ),
+                "model": model,
+                "store": store,
+            },
+            {
+                "cache_size": cache_size,
+                "cache_buckets": cache_buckets,
+                "cache_history": cache_history,
+                "cache_policy": cache_policy,
+            },
+            base_url,
+            {"deadline": deadline, "fallback": fallback},
+            attack_sequence=attack_sequence,
+            max_episode_step=max_episode_step,
+            enable_log=enable_log,
+            prefix=prefix,
+            output_dir=output_dir,
+            log_background=log_background,
+            log_backend=log_backend,
+            log_flush_secs=log_flush_secs,
+            change_num=change_num,
+        )
+    )
+    if store is not None:
+        print("decision store", store.stats())
+        store.close()
+    return results
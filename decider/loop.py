@@ -0,0 +1,292 @@
+from tqdm import tqdm
+import time
+import numpy as np
+from dataclasses import asdict
+from log.log import Logger
+from utils import get_action_thresholds
+
+
+def run_title(env, num_episodes, change_num):
+    timestamp = time.strftime("%Y%m%d-%H%M%S")
+    return (
+        env.attacker.type.value
+        + "-"
+        + str(env.attacker.num)
+        + "-"
+        + str(num_episodes)
+        + "-"
+        + str(change_num)
+        + "-"
+        + "("
+        + timestamp
+        + ")"
+    )
+
+
+def new_logger(
+    title,
+    enable_log=True,
+    prefix="default",
+    output_dir="output",
+    log_background=False,
+    log_backend="tensorboard",
+    log_flush_secs=10,
+):
+    if not enable_log:
+        return None
+    return Logger(
+        prefix,
+        title,
+        output_dir=output_dir,
+        background=log_background,
+        backend=log_backend,
+        flush_secs=log_flush_secs,
+    )
+
+
+def train_loop(
+    env,
+    agent,
+    take_action,
+    num_episodes,
+    attack_sequence,
+    max_fail_num,
+    max_episode_step=30,
+    change_num=0,
+    logger=None,
+):
+    """
+    The episodes of the deciders that decide locally. take_action(state, attack_indicators, step, action_thresholds)
+    returns the action and its thresholds, agent.judge the finish flag of the episode. The messages of every step
+    are printed in debug mode only, so that the loop does not wait on the console.
+    """
+    for_step = 0
+    for_episode_success = False
+
+    survival_rate = []
+    convergence_episode = max_fail_num
+    success_list = []
+    step_num_list = []
+
+    for episode in range(num_episodes):
+        finish = -1
+        step = 0
+        attack_len = len(attack_sequence)
+        max_steps = attack_len
+        state = env.reset()
+        agent.reset()
+
+        txt_datas = []
+        episode_success = []
+
+        if change_num != 0 and episode == num_episodes - 1:
+            env.change_attacker_num(change_num)
+
+        with tqdm(total=max_steps, desc=f"iteration {episode}") as pbar:
+            while finish == -1:
+                if env.debug:
+                    print(f"\nstep {step}")
+                do_attack = attack_sequence[step % attack_len]
+                action_thresholds = get_action_thresholds(env.attacker.type)
+                attack_indicators = env.cal_indicators(state)
+                action, con_percent, mem_percent = take_action(
+                    state, attack_indicators, step, action_thresholds
+                )
+                if env.debug:
+                    print(
+                        "action_msg",
+                        action,
+                        con_percent,
+                        mem_percent,
+                        attack_indicators,
+                    )
+
+                (
+                    next_state,
+                    defence_state,
+                    defence_success,
+                    defence_fail_msg,
+                    defence_cost,
+                ) = env.step(
+                    action,
+                    {"con_percent": con_percent, "mem_percent": mem_percent},
+                    do_attack,
+                )
+                defence_indicators = env.cal_indicators(defence_state, defence_cost)
+                finish, success, fail_msg = agent.judge(defence_indicators)
+                if logger is not None:
+                    logger.write_step(success, defence_success, defence_indicators)
+                if env.debug:
+                    print(
+                        "defence_msg",
+                        defence_success,
+                        defence_fail_msg,
+                        asdict(defence_indicators),
+                    )
+
+                episode_success.append(success)
+
+                step += 1
+                max_steps = max(max_steps, step)
+                state = next_state
+
+                if step >= max_episode_step:
+                    finish = 0
+                    success = 0
+                    fail_msg = (
+                        f"The defense was unsuccessful after {max_episode_step} steps!"
+                    )
+
+                txt_datas.append(
+                    {
+                        "action": [action, con_percent, mem_percent],
+                        "indicators": [
+                            asdict(attack_indicators),
+                            asdict(defence_indicators),
+                        ],
+                        "defence_msg": [defence_success, defence_fail_msg],
+                        "success": [success, fail_msg],
+                    }
+                )
+
+                pbar.set_postfix(
+                    {
+                        "episode": step,
+                        "return": "%.3f" % (success / max_steps),
+                    }
+                )
+                pbar.update(1)
+                if max_steps != attack_len:
+                    pbar.total = max_steps
+                    pbar.refresh()
+
+        for_step = step
+        for_episode_success = finish == 1
+
+        survival_rate.append(sum(episode_success) / len(episode_success))
+        if step == max_fail_num and convergence_episode == max_fail_num:
+            convergence_episode = episode
+        success_list.append(for_episode_success)
+        step_num_list.append(for_step)
+
+        print(
+            f"The {episode} episode has ended, with a total of {for_step} attack-defense cycles. The defense in this episode was {'successful' if for_episode_success else 'failed'}."
+        )
+
+        if logger is not None:
+            logger.write_txt(episode, txt_datas)
+            logger.write_episode(
+                episode,
+                {
+                    "survival_rate": survival_rate[-1],
+                    "success_list": success_list[-1],
+                    "step_num_list": step_num_list[-1],
+                },
+            )
+
+    if logger is not None:
+        logger.write_log(
+            num_episodes,
+            survival_rate,
+            convergence_episode,
+            success_list,
+            step_num_list,
+        )
+        logger.close()
+
+    return (
+        survival_rate,
+        convergence_episode,
+        success_list,
+        step_num_list,
+    )
+
+
+def train_loop_vector(env, take_actions, num_episodes, max_fail_num, logger=None):
+    # env is a VectorEnv: take_actions(state) returns the actions of all clusters of the batch per step,
+    # and finished episodes are collected until num_episodes have ended
+    survival_rate = []
+    convergence_episode = max_fail_num
+    success_list = []
+    step_num_list = []
+    txt_datas = [[] for _ in range(env.num_envs)]
+
+    state, _ = env.reset()
+    with tqdm(total=num_episodes, desc="episodes") as pbar:
+        while len(success_list) < num_episodes:
+            actions = take_actions(state)
+            attack_indicators = env.env.cal_indicators_batch(state, ser_num=env.ser_num)
+            state, rewards, terminations, truncations, infos = env.step(actions)
+
+            for i in range(env.num_envs):
+                if logger is None:
+                    break
+                logger.write_step(
+                    infos["success"][i],
+                    infos["defence_success"][i],
+                    infos["indicators"][i],
+                )
+                con_percent, mem_percent = env.action_thresholds[actions[i]]
+                txt_datas[i].append(
+                    {
+                        "action": [int(actions[i]), con_percent, mem_percent],
+                        "indicators": [
+                            asdict(attack_indicators[i]),
+                            asdict(infos["indicators"][i]),
+                        ],
+                        "defence_msg": [
+                            infos["defence_success"][i],
+                            infos["defence_fail_msg"][i],
+                        ],
+                        "success": (
+                            [
+                                0,
+                                f"The defense was unsuccessful after {env.max_episode_step} steps!",
+                            ]
+                            if truncations[i]
+                            else [infos["success"][i], infos["fail_msg"][i]]
+                        ),
+                    }
+                )
+
+            if "episode" not in infos:
+                continue
+            for i in np.flatnonzero(infos["_episode"]):
+                if len(success_list) >= num_episodes:
+                    break
+                episode = len(success_list)
+                step = int(infos["episode"]["step_num"][i])
+                survival_rate.append(float(infos["episode"]["survival_rate"][i]))
+                if step == max_fail_num and convergence_episode == max_fail_num:
+                    convergence_episode = episode
+                success_list.append(bool(infos["episode"]["success"][i]))
+                step_num_list.append(step)
+                if logger is not None:
+                    logger.write_txt(episode, txt_datas[i])
+                    logger.write_episode(
+                        episode,
+                        {
+                            "survival_rate": survival_rate[-1],
+                            "success_list": success_list[-1],
+                            "step_num_list": step_num_list[-1],
+                        },
+                    )
+                txt_datas[i] = []
+                pbar.update(1)
+
+    if logger is not None:
+        logger.write_log(
+            num_episodes,
+            survival_rate,
+            convergence_episode,
+            success_list,
+            step_num_list,
+        )
+        logger.close()
+
+    return (
+        survival_rate,
+        convergence_episode,
+        success_list,
+        step_num_list,
+    )
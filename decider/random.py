@@ -1,9 +1,6 @@
-from tqdm import tqdm
-import time
 import random
-from dataclasses import asdict
-from log.log import Logger
-from utils import judge_fail_func, get_action_thresholds
+from decider.loop import new_logger, run_title, train_loop, train_loop_vector
+from utils import judge_fail_func
 
 
 class Random:
@@ -46,151 +43,66 @@ def train_and_test(
     max_episode_step=30,
     enable_log=True,
     prefix="default",
+    output_dir="output",
+    log_background=False,
+    log_backend="tensorboard",
+    log_flush_secs=10,
     change_num=0,
 ):
-    timestamp = time.strftime("%Y%m%d-%H%M%S")
-    title = (
-        env.attacker.type.value
-        + "-"
-        + str(env.attacker.num)
-        + "-"
-        + str(num_episodes)
-        + "-"
-        + str(change_num)
-        + "-"
-        + "("
-        + timestamp
-        + ")"
+    logger = new_logger(
+        run_title(env, num_episodes, change_num),
+        enable_log,
+        prefix,
+        output_dir,
+        log_background,
+        log_backend,
+        log_flush_secs,
     )
-    if enable_log:
-        logger = Logger(prefix, title)
-
     agent = Random(max_fail_num)
+    return train_loop(
+        env,
+        agent,
+        lambda state, attack_indicators, step, action_thresholds: agent.take_action(
+            state, step, action_thresholds
+        ),
+        num_episodes,
+        attack_sequence,
+        max_fail_num,
+        max_episode_step,
+        change_num,
+        logger,
+    )
 
-    for_step = 0
-    for_episode_success = False
-
-    survival_rate = []
-    convergence_episode = max_fail_num
-    success_list = []
-    step_num_list = []
-
-    for episode in range(num_episodes):
-        finish = -1
-        step = 0
-        attack_len = len(attack_sequence)
-        max_steps = attack_len
-        state = env.reset()
-        agent.reset()
-
-        txt_datas = []
-        episode_success = []
-
-        if change_num != 0 and episode == num_episodes - 1:
-            env.change_attacker_num(change_num)
-
-        with tqdm(total=max_steps, desc=f"iteration {episode}") as pbar:
-            while finish == -1:
-                print(f"\nstep {step}")
-                do_attack = attack_sequence[step % attack_len]
-                action_thresholds = get_action_thresholds(env.attacker.type)
-                attack_indicators = env.cal_indicators(state)
-                action, con_percent, mem_percent = agent.take_action(
-                    state, step, action_thresholds
-                )
-                print(
-                    "action_msg",
-                    action,
-                    con_percent,
-                    mem_percent,
-                    attack_indicators,
-                )
-
-                (
-                    next_state,
-                    defence_state,
-                    defence_success,
-                    defence_fail_msg,
-                    defence_cost,
-                ) = env.step(
-                    action,
-                    {"con_percent": con_percent, "mem_percent": mem_percent},
-                    do_attack,
-                )
-                defence_indicators = env.cal_indicators(defence_state, defence_cost)
-                finish, success, fail_msg = agent.judge(defence_indicators)
-                print(
-                    "defence_msg",
-                    defence_success,
-                    defence_fail_msg,
-                    asdict(defence_indicators),
-                )
-
-                episode_success.append(success)
-
-                step += 1
-                max_steps = max(max_steps, step)
-                state = next_state
-
-                if step >= max_episode_step:
-                    finish = 0
-                    success = 0
-                    fail_msg = (
-                        f"The defense was unsuccessful after {max_episode_step} steps!"
-                    )
-
-                txt_datas.append(
-                    {
-                        "action": [action, con_percent, mem_percent],
-                        "indicators": [
-                            asdict(attack_indicators),
-                            asdict(defence_indicators),
-                        ],
-                        "defence_msg": [defence_success, defence_fail_msg],
-                        "success": [success, fail_msg],
-                    }
-                )
-
-                pbar.set_postfix(
-                    {
-                        "episode": step,
-                        "return": "%.3f" % (success / max_steps),
-                    }
-                )
-                pbar.update(1)
-                if max_steps != attack_len:
-                    pbar.total = max_steps
-                    pbar.refresh()
-
-        for_step = step
-        for_episode_success = finish == 1
-
-        survival_rate.append(sum(episode_success) / len(episode_success))
-        if step == max_fail_num and convergence_episode == max_fail_num:
-            convergence_episode = episode
-        success_list.append(for_episode_success)
-        step_num_list.append(for_step)
-
-        print(
-            f"The {episode} episode has ended, with a total of {for_step} attack-defense cycles. The defense in this episode was {'successful' if for_episode_success else 'failed'}."
-        )
-
-        if enable_log:
-            logger.write_txt(episode, txt_datas)
-
-    if enable_log:
-        logger.write_log(
-            num_episodes,
-            survival_rate,
-            convergence_episode,
-            success_list,
-            step_num_list,
-        )
-        logger.close()
 
-    return (
-        survival_rate,
-        convergence_episode,
-        success_list,
-        step_num_list,
+def train_and_test_vector(
+    env,
+    num_episodes,
+    max_fail_num,
+    enable_log=True,
+    prefix="default",
+    output_dir="output",
+    log_background=False,
+    log_backend="tensorboard",
+    log_flush_secs=10,
+):
+    # Every cluster of the batch takes a random action per step
+    logger = new_logger(
+        run_title(env, num_episodes, env.num_envs),
+        enable_log,
+        prefix,
+        output_dir,
+        log_background,
+        log_backend,
+        log_flush_secs,
+    )
+    agent = Random(max_fail_num)
+    return train_loop_vector(
+        env,
+        lambda state: [
+            agent.take_action(s, step, env.action_thresholds)[0]
+            for s, step in zip(state, env.step_num)
+        ],
+        num_episodes,
+        max_fail_num,
+        logger,
     )
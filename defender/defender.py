@@ -1,5 +1,4 @@
 import numpy as np
-import math
 from constants import DefenceStrategy
 
 
@@ -14,15 +13,55 @@ class Defender:
         """
         self.env.ser_num = 5
         for i in range(self.env.ser_num):
-            port = np.random.randint(30000, 32767)
-            while port in self.env.state[:, 2]:
-                port = np.random.randint(30000, 32767)
-            connection = np.random.randint(int(10 * 256 * 0.5), int(10 * 256 * 0.6))
-            mem = np.random.randint(int(10 * 100 * 0.1), int(10 * 100 * 0.5))
+            port = self.env.port_pool.alloc()
+            connection = self.env.rng.randint(int(10 * 256 * 0.5), int(10 * 256 * 0.6))
+            mem = self.env.rng.randint(int(10 * 100 * 0.1), int(10 * 100 * 0.5))
             self.env.state[i] = [10, connection, port, mem]
+            self.env.state_index.set(i, port)
 
     def step(self, defence_strategy, params):
-        inf_services = []
+        # A single cluster is a batch of one: the kernels write through the view into env.state
+        ser_num = np.array([self.env.ser_num], dtype=np.int64)
+        pod_remain = np.array([self.env.pod_remain], dtype=np.int64)
+        old_ports = self.env.state[:, 2].copy()
+        success, fail_msgs, costs, ports = self.step_batch(
+            defence_strategy,
+            params,
+            self.env.state[np.newaxis],
+            self.env.attack_state[np.newaxis],
+            ser_num,
+            pod_remain,
+            [self.env.port_pool],
+        )
+        self.env.ser_num = int(ser_num[0])
+        self.env.pod_remain = pod_remain[0]
+        self.env.state_index.sync(
+            self.env.state[:, 2], np.flatnonzero(self.env.state[:, 2] != old_ports)
+        )
+        for key, value in ports.items():
+            getattr(self.env, key).extend(value[0][value[0] > 0].tolist())
+        return bool(success[0]), fail_msgs[0], int(costs[0])
+
+    def step_batch(
+        self, defence_strategy, params, state, attack_state, ser_num, pod_remain, pools
+    ):
+        """
+        Apply one defence strategy to a batch of clusters.
+        state (n, ser_max_num, ser_ind), ser_num (n,) and pod_remain (n,) are updated in place, attack_state is only read.
+        pools holds the PortPool of each cluster, new ports are drawn from it and released ports are given back.
+        Returns the success flags, the messages and the costs per cluster, together with the ports the attacker has to follow:
+        port_list (replaced ports), add_ser_list1 / add_ser_list2 (copied replicas and their copies) and del_ser_list,
+        each as an (n, ser_max_num) array in event order padded with 0.
+        """
+        n = state.shape[0]
+        success = np.ones(n, dtype=bool)
+        fail_msgs = [None] * n
+        costs = np.zeros(n, dtype=np.int64)
+        ports = {
+            key: np.zeros((n, self.env.ser_max_num), dtype=np.int64)
+            for key in ["port_list", "add_ser_list1", "add_ser_list2", "del_ser_list"]
+        }
+
         if defence_strategy in [
             DefenceStrategy.REPLICA_INCREASE,
             DefenceStrategy.REPLICA_DECREASE,
@@ -38,224 +77,371 @@ class Defender:
                 or mem_percent > 1
                 # or (con_percent == 0 and mem_percent == 0)
             ):
-                return False, "The parameters are invalid.", 0
+                success[:] = False
+                return success, ["The parameters are invalid."] * n, costs, ports
+
+        pods = state[:, :, 0]
+        con = state[:, :, 1]
+        mem = state[:, :, 3]
         if defence_strategy == DefenceStrategy.PORT_HOPPING:
-            # Port hopping
-            for i in range(self.env.ser_max_num):
-                if self.env.state[i][0] > 0:
-                    inf_services.append(i)
-                    self.env.port_list.append(self.env.state[i][2])
-                    # Reset the attack traffic while keeping the normal traffic unchanged.
-                    if self.env.state[i][2] in self.env.attack_state[:, 0]:
-                        ind = self.env.get_attack_index(self.env.state[i][2])
-                        # Connection usage
-                        self.env.state[i][1] = (
-                            self.env.state[i][1] - self.env.attack_state[ind][4]
-                        )
-                        # Memory usage
-                        self.env.state[i][3] = (
-                            self.env.state[i][3] - self.env.attack_state[ind][5]
-                        )
-                    port = np.random.randint(30000, 32767)
-                    while (
-                        port in self.env.state[:, 2]
-                    ):  # Make sure the port number does not overlap with the original port or other used ports.
-                        port = np.random.randint(30000, 32767)
-                    self.env.state[i][2] = port
-            return (
-                True,
-                f"The port of service replica {inf_services} was changed successfully",
-                4,
+            self._port_hopping(
+                state, attack_state, pools, success, fail_msgs, costs, ports
             )
-        elif defence_strategy == DefenceStrategy.REPLICA_INCREASE:
-            # Select service replicas with a load rate exceeding the specified threshold and create a new replica.
-            # The number of pods for the new replica will be the same as the original service, and half of the total traffic will be assigned to the new replica.
-            if self.env.ser_num == self.env.ser_max_num:
-                return False, "The maximum number of replicas has been reached", 0
-            elif self.env.pod_remain == 0:
-                return False, "There are no remaining resource pods to allocate", 0
+        elif defence_strategy == DefenceStrategy.NO_ACTION:
+            fail_msgs = ["No action"] * n
+        elif defence_strategy in [
+            DefenceStrategy.REPLICA_INCREASE,
+            DefenceStrategy.REPLICA_EXPAND,
+        ]:
+            # Replicas whose load rate exceeds the specified thresholds
+            over = (con > con_percent * pods * self.env.pod_con_num) & (
+                mem > mem_percent * pods * self.env.pod_mem_num
+            )
+            kernel = (
+                self._replica_increase
+                if defence_strategy == DefenceStrategy.REPLICA_INCREASE
+                else self._replica_expand
+            )
+            kernel(
+                state,
+                over,
+                con_percent,
+                mem_percent,
+                ser_num,
+                pod_remain,
+                pools,
+                success,
+                fail_msgs,
+                costs,
+                ports,
+            )
+        elif defence_strategy in [
+            DefenceStrategy.REPLICA_DECREASE,
+            DefenceStrategy.REPLICA_SHRINK,
+        ]:
+            # Replicas whose load rate is below the specified thresholds
+            under = (con < con_percent * pods * self.env.pod_con_num) & (
+                mem < mem_percent * pods * self.env.pod_mem_num
+            )
+            kernel = (
+                self._replica_decrease
+                if defence_strategy == DefenceStrategy.REPLICA_DECREASE
+                else self._replica_shrink
+            )
+            kernel(
+                state,
+                under,
+                con_percent,
+                mem_percent,
+                ser_num,
+                pod_remain,
+                pools,
+                success,
+                fail_msgs,
+                costs,
+            )
+        return success, fail_msgs, costs, ports
+
+    def _port_hopping(
+        self, state, attack_state, pools, success, fail_msgs, costs, ports
+    ):
+        # Port hopping on every replica that has pods
+        hop = state[:, :, 0] > 0
+        old_ports = state[:, :, 2].copy()
+        ports["port_list"][hop] = old_ports[hop]
+
+        # Reset the attack traffic while keeping the normal traffic unchanged.
+        match = attack_state[:, np.newaxis, :, 0] == old_ports[:, :, np.newaxis]
+        attacked = hop & match.any(axis=2)
+        ind = match.argmax(axis=2)
+        attack_con = np.take_along_axis(attack_state[:, :, 4], ind, axis=1)
+        attack_mem = np.take_along_axis(attack_state[:, :, 5], ind, axis=1)
+        state[:, :, 1] -= np.where(attacked, attack_con, 0)  # Connection usage
+        state[:, :, 3] -= np.where(attacked, attack_mem, 0)  # Memory usage
+
+        # The new ports never overlap with the original ports or other used ports
+        for b in range(state.shape[0]):
+            rows = np.flatnonzero(hop[b])
+            state[b, rows, 2] = pools[b].alloc_many(len(rows))
+            pools[b].free_many(old_ports[b, rows])
+
+        costs[:] = 4
+        for b in range(state.shape[0]):
+            fail_msgs[b] = (
+                f"The port of service replica {np.flatnonzero(hop[b]).tolist()} was changed successfully"
+            )
+
+    def _replica_increase(
+        self,
+        state,
+        over,
+        con_percent,
+        mem_percent,
+        ser_num,
+        pod_remain,
+        pools,
+        success,
+        fail_msgs,
+        costs,
+        ports,
+    ):
+        # Select service replicas with a load rate exceeding the specified threshold and create a new replica.
+        # The number of pods for the new replica will be the same as the original service, and half of the total traffic will be assigned to the new replica.
+        ser_max_num = self.env.ser_max_num
+        pods = state[:, :, 0]
+        full = ser_num == ser_max_num
+        no_pod = ~full & (pod_remain == 0)
+
+        # Replicas are copied in row order while pods and replica slots last, the first one that cannot be copied stops the defence
+        pod_need = np.cumsum(np.where(over, pods, 0), axis=1)
+        copy_num = np.cumsum(over, axis=1)
+        fit = (pod_need <= pod_remain[:, np.newaxis]) & (
+            copy_num <= (ser_max_num - ser_num)[:, np.newaxis]
+        )
+        copy = over & fit & ~(full | no_pod)[:, np.newaxis]
+        stopped = np.any(over & ~fit, axis=1) & ~(full | no_pod)
+
+        # Copies go to the first rows without pods, in the order of the copied replicas
+        con_half = (0.5 * state[:, :, 1]).astype(np.int64)
+        mem_half = (0.5 * state[:, :, 3]).astype(np.int64)
+        rank = np.cumsum(copy, axis=1) - 1
+        free_rows = np.argsort(pods > 0, axis=1, kind="stable")
+        slot = np.take_along_axis(free_rows, np.maximum(rank, 0), axis=1)
+        # A copy that lands after its replica is visited again and may be copied once more,
+        # and replicas without pods may take their own row: such clusters follow the replica order step by step
+        copy_over = (con_half > con_percent * pods * self.env.pod_con_num) & (
+            mem_half > mem_percent * pods * self.env.pod_mem_num
+        )
+        sequential = np.any(
+            (copy & copy_over & (slot > np.arange(ser_max_num)))
+            | (over & (pods == 0))
+            | (rank >= np.count_nonzero(pods == 0, axis=1)[:, np.newaxis]) & copy,
+            axis=1,
+        ) & ~(full | no_pod)
+
+        for b in range(state.shape[0]):
+            if full[b]:
+                success[b] = False
+                fail_msgs[b] = "The maximum number of replicas has been reached"
+                continue
+            if no_pod[b]:
+                success[b] = False
+                fail_msgs[b] = "There are no remaining resource pods to allocate"
+                continue
+            if sequential[b]:
+                inf_services, stopped[b] = self._replica_increase_rows(
+                    state[b],
+                    con_percent,
+                    mem_percent,
+                    ser_num,
+                    pod_remain,
+                    pools[b],
+                    b,
+                    ports,
+                )
             else:
-                for i in range(self.env.ser_max_num):
-                    if (
-                        self.env.state[i][1]
-                        > con_percent * self.env.state[i][0] * self.env.pod_con_num
-                        and self.env.state[i][3]
-                        > mem_percent * self.env.state[i][0] * self.env.pod_mem_num
-                    ):
-                        if (
-                            self.env.pod_remain >= self.env.state[i][0]
-                            and self.env.ser_num < self.env.ser_max_num
-                        ):
-                            inf_services.append(i)
-                            self.env.add_ser_list1.append(self.env.state[i][2])
-                            new_pod = self.env.state[i][0]
-                            connection = 0.5 * self.env.state[i][1]
-                            self.env.state[i][1] = connection
-                            mem = 0.5 * self.env.state[i][3]
-                            self.env.state[i][3] = mem
-                            port = np.random.randint(30000, 32767)
-                            while port in self.env.state[:, 2]:
-                                port = np.random.randint(30000, 32767)
-                            for j in range(
-                                self.env.ser_max_num
-                            ):  # Locate the extended copy
-                                if self.env.state[j][0] == 0:
-                                    self.env.state[j] = np.array(
-                                        [new_pod, connection, port, mem]
-                                    )
-                                    self.env.add_ser_list2.append(port)
-                                    self.env.pod_remain -= new_pod
-                                    self.env.ser_num += 1
-                                    break
-                        else:
-                            return (
-                                False,
-                                "There are no remaining resource pods to allocate",
-                                0,
-                            )
-                if len(inf_services) == 0:
-                    return (
-                        False,
-                        "There are no replicas that exceed the specified load ratio, so there is no need to add replicas",
-                        0,
-                    )
-                else:
-                    return True, f"Replica added successfully {inf_services}", 1
-        elif defence_strategy == DefenceStrategy.REPLICA_DECREASE:
-            # Delete the replicas with a load rate lower than the specified one,
-            # and distribute the traffic of the deleted services (including users and attackers) to other services;
-            # The number of services cannot be less than 1
-            all_delete = True
-            for i in range(self.env.ser_max_num):
-                if (
-                    self.env.state[i][1]
-                    >= con_percent * self.env.state[i][0] * self.env.pod_con_num
-                    or self.env.state[i][3]
-                    >= mem_percent * self.env.state[i][0] * self.env.pod_mem_num
-                ):
-                    all_delete = False
-            if all_delete:
-                return (
-                    False,
-                    "The load rate is set too high and all replicas will be deleted.",
-                    0,
+                rows = np.flatnonzero(copy[b])
+                inf_services = rows.tolist()
+                ports["add_ser_list1"][b, : len(rows)] = state[b, rows, 2]
+                ports["add_ser_list2"][b, : len(rows)] = pools[b].alloc_many(len(rows))
+                # A row without pods may still hold the port of a shrunk replica
+                pools[b].free_many(state[b, slot[b, rows], 2])
+                state[b, rows, 1] = con_half[b, rows]
+                state[b, rows, 3] = mem_half[b, rows]
+                state[b, slot[b, rows]] = np.stack(
+                    [
+                        pods[b, rows],
+                        con_half[b, rows],
+                        ports["add_ser_list2"][b, : len(rows)],
+                        mem_half[b, rows],
+                    ],
+                    axis=1,
                 )
-            con_num = 0
-            mem_num = 0
-            for i in range(self.env.ser_max_num):
-                if (
-                    self.env.state[i][1]
-                    < con_percent * self.env.state[i][0] * self.env.pod_con_num
-                    and self.env.state[i][3]
-                    < mem_percent * self.env.state[i][0] * self.env.pod_mem_num
-                ):
-                    inf_services.append(i)
-                    con_num += self.env.state[i][1]
-                    mem_num += self.env.state[i][3]
-                    self.env.state[i] = np.array([0, 0, 0, 0])
-                    self.env.ser_num -= 1
-                    self.env.pod_remain += 1
-            for j in range(self.env.ser_max_num):
-                if self.env.state[j][0]:
-                    self.env.state[j][1] += con_num // self.env.ser_num
-                    self.env.state[j][3] += mem_num // self.env.ser_num
-            if len(inf_services) == 0:
-                return (
-                    False,
-                    "There are no replicas with a load ratio lower than the specified value, so there is no need to reduce the number of replicas.",
-                    0,
+                pod_remain[b] -= np.sum(pods[b, rows])
+                ser_num[b] += len(rows)
+
+            if stopped[b]:
+                success[b] = False
+                fail_msgs[b] = "There are no remaining resource pods to allocate"
+            elif len(inf_services) == 0:
+                success[b] = False
+                fail_msgs[b] = (
+                    "There are no replicas that exceed the specified load ratio, so there is no need to add replicas"
                 )
             else:
-                return True, f"Replica deleted successfully {inf_services}", 0
-        elif defence_strategy == DefenceStrategy.REPLICA_EXPAND:
-            # Select all replicas with a load rate greater than the specified one and expand them.
-            # After expansion, the load rate will be the specified load rate to ensure service quality;
-            if self.env.pod_remain == 0:
-                return False, "There are no remaining resource pods to allocate", 0
-            else:
-                for i in range(self.env.ser_max_num):
-                    if (
-                        self.env.state[i][1]
-                        > con_percent * self.env.state[i][0] * self.env.pod_con_num
-                        and self.env.state[i][3]
-                        > mem_percent * self.env.state[i][0] * self.env.pod_mem_num
-                    ):
-                        con_incre = (
-                            int(
-                                math.ceil(
-                                    self.env.state[i][1]
-                                    / (self.env.pod_con_num * con_percent)
-                                    - self.env.state[i][0]
-                                )
-                            )
-                            if con_percent != 0
-                            else 0
-                        )
-                        mem_incre = (
-                            int(
-                                math.ceil(
-                                    self.env.state[i][3]
-                                    / (self.env.pod_mem_num * mem_percent)
-                                    - self.env.state[i][0]
-                                )
-                            )
-                            if mem_percent != 0
-                            else 0
-                        )
-                        pod_incre = max(con_incre, mem_incre)
-                        if self.env.pod_remain >= pod_incre:
-                            inf_services.append(i)
-                            self.env.state[i][0] = self.env.state[i][0] + pod_incre
-                            self.env.pod_remain -= pod_incre
-                        else:
-                            return (
-                                False,
-                                "There are no remaining resource pods to allocate",
-                                0,
-                            )
-                if len(inf_services) == 0:
-                    return (
-                        False,
-                        "There are no replicas that exceed the specified load ratio, so there is no need to add resource pods",
-                        0,
-                    )
-                else:
-                    return True, f"服务{inf_services}副本扩容成功", 1
-        elif defence_strategy == DefenceStrategy.REPLICA_SHRINK:
-            # Select replicas with a load rate lower than the specified load rate and scale them down.
-            # The load rate after scaling down is the specified load rate to ensure the lowest energy consumption ratio;
-            for i in range(self.env.ser_max_num):
-                if (
-                    self.env.state[i][1]
-                    < con_percent * self.env.state[i][0] * self.env.pod_con_num
-                    and self.env.state[i][3]
-                    < mem_percent * self.env.state[i][0] * self.env.pod_mem_num
+                costs[b] = 1
+                fail_msgs[b] = f"Replica added successfully {inf_services}"
+
+    def _replica_increase_rows(
+        self, state, con_percent, mem_percent, ser_num, pod_remain, pool, b, ports
+    ):
+        # Row by row replica creation of one cluster, including copies that are copied again
+        inf_services = []
+        for i in range(self.env.ser_max_num):
+            if (
+                state[i][1] > con_percent * state[i][0] * self.env.pod_con_num
+                and state[i][3] > mem_percent * state[i][0] * self.env.pod_mem_num
+            ):
+                if not (
+                    pod_remain[b] >= state[i][0] and ser_num[b] < self.env.ser_max_num
                 ):
-                    con_decre = int(
-                        self.env.state[i][0]
-                        - self.env.state[i][1] / (self.env.pod_con_num * con_percent)
-                    )
-                    mem_decre = int(
-                        self.env.state[i][0]
-                        - self.env.state[i][3] / (self.env.pod_mem_num * mem_percent)
-                    )
-                    pod_decre = max(con_decre, mem_decre)
-                    inf_services.append(i)
-                    self.env.state[i][0] = self.env.state[i][0] - pod_decre
-                    self.env.pod_remain += pod_decre
-            if len(inf_services) == 0:
-                return (
-                    False,
-                    "There are no replicas with a load ratio lower than the specified one, so no scaling down is required.",
-                    0,
+                    return inf_services, True
+                k = len(inf_services)
+                inf_services.append(i)
+                ports["add_ser_list1"][b, k] = state[i][2]
+                new_pod = state[i][0]
+                connection = 0.5 * state[i][1]
+                state[i][1] = connection
+                mem = 0.5 * state[i][3]
+                state[i][3] = mem
+                port = pool.alloc()
+                for j in range(self.env.ser_max_num):  # Locate the extended copy
+                    if state[j][0] == 0:
+                        pool.free(state[j][2])
+                        state[j] = np.array([new_pod, connection, port, mem])
+                        ports["add_ser_list2"][b, k] = port
+                        pod_remain[b] -= new_pod
+                        ser_num[b] += 1
+                        break
+                else:
+                    pool.free(port)
+        return inf_services, False
+
+    def _replica_decrease(
+        self,
+        state,
+        under,
+        con_percent,
+        mem_percent,
+        ser_num,
+        pod_remain,
+        pools,
+        success,
+        fail_msgs,
+        costs,
+    ):
+        # Delete the replicas with a load rate lower than the specified one,
+        # and distribute the traffic of the deleted services (including users and attackers) to other services;
+        # The number of services cannot be less than 1
+        all_delete = np.all(under, axis=1)
+        delete = under & ~all_delete[:, np.newaxis]
+
+        con_num = np.sum(state[:, :, 1], axis=1, where=delete)
+        mem_num = np.sum(state[:, :, 3], axis=1, where=delete)
+        for b in np.flatnonzero(np.any(delete, axis=1)):
+            pools[b].free_many(state[b, delete[b], 2])
+        state[delete] = 0
+        delete_num = np.count_nonzero(delete, axis=1)
+        ser_num -= delete_num
+        pod_remain += delete_num
+        remain = state[:, :, 0] != 0
+        with np.errstate(divide="ignore"):
+            state[:, :, 1] += np.where(remain, (con_num // ser_num)[:, np.newaxis], 0)
+            state[:, :, 3] += np.where(remain, (mem_num // ser_num)[:, np.newaxis], 0)
+
+        for b in range(state.shape[0]):
+            if all_delete[b]:
+                success[b] = False
+                fail_msgs[b] = (
+                    "The load rate is set too high and all replicas will be deleted."
+                )
+            elif delete_num[b] == 0:
+                success[b] = False
+                fail_msgs[b] = (
+                    "There are no replicas with a load ratio lower than the specified value, so there is no need to reduce the number of replicas."
                 )
             else:
-                return (
-                    True,
-                    f"The replica was successfully scaled down {inf_services}",
-                    0,
+                fail_msgs[b] = (
+                    f"Replica deleted successfully {np.flatnonzero(delete[b]).tolist()}"
                 )
-        elif defence_strategy == DefenceStrategy.NO_ACTION:
-            return True, "No action", 0
 
-        return True, None, 0
+    def _replica_expand(
+        self,
+        state,
+        over,
+        con_percent,
+        mem_percent,
+        ser_num,
+        pod_remain,
+        pools,
+        success,
+        fail_msgs,
+        costs,
+        ports,
+    ):
+        # Select all replicas with a load rate greater than the specified one and expand them.
+        # After expansion, the load rate will be the specified load rate to ensure service quality;
+        pods = state[:, :, 0]
+        no_pod = pod_remain == 0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            con_incre = (
+                np.ceil(state[:, :, 1] / (self.env.pod_con_num * con_percent) - pods)
+                if con_percent != 0
+                else np.zeros(pods.shape)
+            )
+            mem_incre = (
+                np.ceil(state[:, :, 3] / (self.env.pod_mem_num * mem_percent) - pods)
+                if mem_percent != 0
+                else np.zeros(pods.shape)
+            )
+            pod_incre = np.where(over, np.maximum(con_incre, mem_incre), 0).astype(
+                np.int64
+            )
+
+        # Replicas are expanded in row order until the remaining pods run out
+        fit = np.cumsum(pod_incre, axis=1) <= pod_remain[:, np.newaxis]
+        expand = over & fit & ~no_pod[:, np.newaxis]
+        stopped = np.any(over & ~fit, axis=1) & ~no_pod
+        pods += np.where(expand, pod_incre, 0)
+        pod_remain -= np.sum(pod_incre, axis=1, where=expand)
+
+        for b in range(state.shape[0]):
+            if no_pod[b] or stopped[b]:
+                success[b] = False
+                fail_msgs[b] = "There are no remaining resource pods to allocate"
+            elif not np.any(expand[b]):
+                success[b] = False
+                fail_msgs[b] = (
+                    "There are no replicas that exceed the specified load ratio, so there is no need to add resource pods"
+                )
+            else:
+                costs[b] = 1
+                fail_msgs[b] = f"服务{np.flatnonzero(expand[b]).tolist()}副本扩容成功"
+
+    def _replica_shrink(
+        self,
+        state,
+        under,
+        con_percent,
+        mem_percent,
+        ser_num,
+        pod_remain,
+        pools,
+        success,
+        fail_msgs,
+        costs,
+    ):
+        # Select replicas with a load rate lower than the specified load rate and scale them down.
+        # The load rate after scaling down is the specified load rate to ensure the lowest energy consumption ratio;
+        pods = state[:, :, 0]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            con_decre = (
+                pods - state[:, :, 1] / (self.env.pod_con_num * con_percent)
+            ).astype(np.int64)
+            mem_decre = (
+                pods - state[:, :, 3] / (self.env.pod_mem_num * mem_percent)
+            ).astype(np.int64)
+        pod_decre = np.where(under, np.maximum(con_decre, mem_decre), 0)
+        pods -= pod_decre
+        pod_remain += np.sum(pod_decre, axis=1)
+
+        for b in range(state.shape[0]):
+            if not np.any(under[b]):
+                success[b] = False
+                fail_msgs[b] = (
+                    "There are no replicas with a load ratio lower than the specified one, so no scaling down is required."
+                )
+            else:
+                fail_msgs[b] = (
+                    f"The replica was successfully scaled down {np.flatnonzero(under[b]).tolist()}"
+                )
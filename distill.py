@@ -0,0 +1,208 @@
+import argparse
+import os
+import time
+from glob import glob
+import pandas as pd
+from decider.distilled import DistilledPolicy
+from log.llm_log import read_journal
+from log.trajectory import INDICATORS, load_trajectory
+
+# Distills the decisions of finished runs, e.g. the LLM runs of a sweep, into the tabular policy of the DISTILLED decider:
+# python distill.py --runs output/survival_rate --policy output/policy.json
+# python main.py --decider_type DISTILLED --policy_path output/policy.json ...
+# python distill.py --runs output/survival_rate --policy output/policy.json --compare output/distilled
+
+
+def find_runs(roots, decider_type):
+    # Run directories below roots written by decider_type, with the output of Logger
+    runs = []
+    for root in roots:
+        for path in glob(os.path.join(root, "**", "log", "log.csv"), recursive=True):
+            run_dir = os.path.dirname(os.path.dirname(path))
+            if f"-{decider_type}-" in os.path.basename(run_dir):
+                runs.append(run_dir)
+    return sorted(runs)
+
+
+def decision_reasons(run_dir):
+    # The reasons given for the decisions of every episode in the prompt journal, streamed from it
+    path = os.path.join(run_dir, "prompts", "journal.jsonl")
+    reasons = {}
+    if not os.path.exists(path):
+        return reasons
+    for record in read_journal(path, ("message",)):
+        if record["content"].startswith(
+            "The defense action to be taken in this step is"
+        ):
+            reasons.setdefault(record["episode"], []).append(
+                record["content"].partition("The reason for this decision is")[2]
+            )
+    return reasons
+
+
+def load_samples(run_dir, include_fallback=False):
+    # (indicators before the decision, actions before in the episode, action, success) of every step,
+    # decisions of the fallback policy of an LLM deadline are left out unless include_fallback
+    samples = []
+    episode_reasons = decision_reasons(run_dir)
+    for episode, steps in load_trajectory(run_dir).groupby("episode"):
+        steps = steps.sort_values("step")
+        reasons = episode_reasons.get(episode)
+        if reasons is not None and len(reasons) != len(steps):
+            reasons = None
+        actions = steps["action"].tolist()
+        indicators = steps[[f"attack_{name}" for name in INDICATORS]].to_numpy()
+        successes = steps["success"].tolist()
+        for step, action in enumerate(actions):
+            if (
+                include_fallback
+                or reasons is None
+                or "fallback policy was taken" not in reasons[step]
+            ):
+                samples.append(
+                    (
+                        dict(zip(INDICATORS, indicators[step])),
+                        actions[:step],
+                        action,
+                        successes[step],
+                    )
+                )
+    return samples
+
+
+def summarize(runs):
+    if not runs:
+        return {"runs": 0}
+    df = pd.concat(
+        [pd.read_csv(os.path.join(run_dir, "log", "log.csv")) for run_dir in runs]
+    )
+    return {
+        "runs": len(runs),
+        "episodes": len(df),
+        "survival_rate": round(df["survival_rate"].mean(), 4),
+        "success_rate": round(df["success_list"].mean(), 4),
+        "step_num": round(df["step_num_list"].mean(), 4),
+    }
+
+
+def distill(
+    roots,
+    policy_path,
+    decider_type="LLM",
+    buckets=10,
+    history=1,
+    include_fallback=False,
+    compare=None,
+    compare_type="DISTILLED",
+):
+    runs = find_runs(roots, decider_type)
+    samples = [
+        sample for run_dir in runs for sample in load_samples(run_dir, include_fallback)
+    ]
+    if not samples:
+        raise ValueError(
+            f"There are no decisions of logged {decider_type} runs in {roots}"
+        )
+    policy = DistilledPolicy(buckets, history).fit(samples)
+    policy.save(policy_path)
+
+    start = time.perf_counter()
+    agreement = sum(
+        policy.action(indicators, actions) == action
+        for indicators, actions, action, _ in samples
+    ) / len(samples)
+    decision_time = (time.perf_counter() - start) / len(samples)
+    print(
+        f"Distilled {len(samples)} decisions of {len(runs)} {decider_type} runs into {len(policy.table)} keys, "
+        f"{agreement:.1%} of them are reproduced, {decision_time * 1e6:.1f} us per decision, saved to {policy_path}"
+    )
+
+    report = pd.DataFrame(
+        [{"decider_type": decider_type, **summarize(runs)}]
+        + (
+            [
+                {
+                    "decider_type": compare_type,
+                    **summarize(find_runs(compare, compare_type)),
+                }
+            ]
+            if compare
+            else []
+        )
+    )
+    print(report.to_string(index=False))
+    return policy, report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="argparse")
+    parser.add_argument(
+        "--runs",
+        type=str,
+        nargs="+",
+        required=True,
+        help="Directories searched for the runs to distill, e.g. output or output/<sweep name>",
+    )
+    parser.add_argument(
+        "--policy",
+        type=str,
+        required=False,
+        default="policy.json",
+        help="Path of the distilled policy",
+    )
+    parser.add_argument(
+        "--decider_type",
+        type=str,
+        required=False,
+        default="LLM",
+        help="Decider whose runs are distilled",
+    )
+    parser.add_argument(
+        "--buckets",
+        type=int,
+        required=False,
+        default=10,
+        help="Buckets of every indicator",
+    )
+    parser.add_argument(
+        "--history",
+        type=int,
+        required=False,
+        default=1,
+        help="Recent actions of the episode in the keys of the policy",
+    )
+    parser.add_argument(
+        "--include_fallback",
+        type=bool,
+        required=False,
+        default=False,
+        help="Also distill the decisions of the fallback policy of an LLM deadline",
+    )
+    parser.add_argument(
+        "--compare",
+        type=str,
+        nargs="*",
+        required=False,
+        default=None,
+        help="Directories searched for runs of the distilled policy to compare",
+    )
+    parser.add_argument(
+        "--report",
+        type=str,
+        required=False,
+        default=None,
+        help="CSV file of the comparison",
+    )
+
+    args = parser.parse_args()
+    _, report = distill(
+        args.runs,
+        args.policy,
+        args.decider_type,
+        args.buckets,
+        args.history,
+        args.include_fallback,
+        args.compare,
+    )
+    if args.report is not None:
+        report.to_csv(args.report, index=False)
@@ -3,7 +3,9 @@ from gymnasium import spaces
 import numpy as np
 from attacker.attacker import attackerFactory
 from defender.defender import Defender
-from constants import Indicators, map_action_to_defence
+from constants import Indicators, IndicatorsBatch, map_action_to_defence
+from port_index import PortIndex
+from port_pool import PortPool
 
 
 class Env(gym.Env):
@@ -39,14 +41,50 @@ class Env(gym.Env):
             self.defence_num
         )  # The size of the action space, one dimension
 
+        # port -> row indexes of state and attack_state, checked against the arrays in debug mode
+        self.state_index = PortIndex()
+        self.attack_index = PortIndex()
+        self.debug = getattr(args, "debug", False)
+        # Source of the random numbers of the cluster, see use_rng
+        self.rng = np.random
+        # Service ports in use, new ports are drawn from the free ones
+        self.port_pool = PortPool(
+            reuse_window=getattr(args, "port_reuse_window", 0),
+            seed=getattr(args, "port_seed", None),
+        )
+
+        # Ring of preallocated buffers behind snapshot / restore, the oldest snapshot is overwritten first
+        self.snapshot_num = 8
+        self.snapshot_count = 0
+        self.snapshot_tokens = np.full(self.snapshot_num, -1, dtype=np.int64)
+        self.snapshot_state = np.zeros(
+            (self.snapshot_num, self.ser_max_num, self.ser_ind), dtype=np.int64
+        )
+        self.snapshot_attack_state = np.zeros(
+            (self.snapshot_num, self.ser_max_num, 6), dtype=np.int64
+        )
+        self.snapshot_pool_ports = np.zeros(
+            (self.snapshot_num,) + self.port_pool.ports.shape, dtype=np.int64
+        )
+        self.snapshot_pool_pos = np.zeros_like(self.snapshot_pool_ports)
+        self.snapshot_values = [None] * self.snapshot_num
+
         self.attacker = attackerFactory(self, args.attacker_type, args.attacker_num)
         self.defender = Defender(self)
         self.defence_strategy = None
 
+    def use_rng(self, rng):
+        # The cluster and its unseeded port pool draw from rng, e.g. a RandomState of their own in one of several concurrent runs
+        self.rng = rng
+        self.port_pool.shared_rng = rng
+
     def reset(self):
         self.state = np.zeros((self.ser_max_num, self.ser_ind), dtype=np.int64)
         self.attack_state = np.zeros((self.ser_max_num, 6), dtype=np.int64)
         self.steps_beyond_terminated = 0
+        self.state_index.clear()
+        self.attack_index.clear()
+        self.port_pool.reset()
 
         self.defender.reset()
         self.attacker.reset()
@@ -68,13 +106,8 @@ class Env(gym.Env):
         self.add_ser_list2 = []  # New services generated by extended replicas
         self.del_ser_list = []  # deleted replica service
 
-        save_state = self.state.copy()  # Save the service status of the previous moment
-        save_attack_state = (
-            self.attack_state.copy()
-        )  # Save the attack status of the previous moment
-        save_ser_num = (
-            self.ser_num
-        )  # Save the number of services at the previous moment
+        # Save the status of the previous moment
+        token = self.snapshot() if simulate else None
 
         # transfer action to defence_strategy
         defence_strategy = map_action_to_defence[action]
@@ -91,15 +124,17 @@ class Env(gym.Env):
             )  # Input attack traffic and execute attack strategy according to defense strategy
         else:
             self.state = np.zeros((self.ser_max_num, self.ser_ind), dtype=np.int64)
+            self.state_index.clear()
+            self.port_pool.reset()
             self.attacker.reset()  # Silent for one round, no attack
             self.defender.reset()  # Normal user traffic, clear attack traffic
         next_state = self.state.copy()  # The service status at the next moment
 
         # If it is a simulated execution, then the defense is executed and restored to the previous state
         if simulate:
-            self.state = save_state
-            self.attack_state = save_attack_state
-            self.ser_num = save_ser_num
+            self.restore(token)
+        if self.debug:
+            self.validate_index()
 
         return (
             next_state,
@@ -109,62 +144,230 @@ class Env(gym.Env):
             defence_cost,
         )
 
+    def snapshot(self):
+        """
+        Save the full simulator state into the next slot of the ring and return its token.
+        A token stays valid until snapshot_num later snapshots have been taken.
+        """
+        token = self.snapshot_count
+        slot = token % self.snapshot_num
+        self.snapshot_count += 1
+        self.snapshot_tokens[slot] = token
+        self.snapshot_state[slot] = self.state
+        self.snapshot_attack_state[slot] = self.attack_state
+        pool_values = self.port_pool.save(
+            self.snapshot_pool_ports[slot], self.snapshot_pool_pos[slot]
+        )[2:]
+        # The bookkeeping lists are replaced, not modified, by the next step, so they are kept by reference
+        self.snapshot_values[slot] = (
+            self.ser_num,
+            getattr(self, "pod_remain", None),
+            self.steps_beyond_terminated,
+            self.attacker.save(),
+            pool_values,
+            getattr(self, "port_list", None),
+            getattr(self, "add_ser_list1", None),
+            getattr(self, "add_ser_list2", None),
+            getattr(self, "del_ser_list", None),
+        )
+        return token
+
+    def restore(self, token):
+        slot = token % self.snapshot_num
+        if self.snapshot_tokens[slot] != token:
+            raise ValueError(f"Snapshot {token} has been overwritten")
+        np.copyto(self.state, self.snapshot_state[slot])
+        np.copyto(self.attack_state, self.snapshot_attack_state[slot])
+        (
+            self.ser_num,
+            self.pod_remain,
+            self.steps_beyond_terminated,
+            attacker,
+            pool_values,
+            self.port_list,
+            self.add_ser_list1,
+            self.add_ser_list2,
+            self.del_ser_list,
+        ) = self.snapshot_values[slot]
+        self.attacker.load(attacker)
+        self.port_pool.load(
+            (self.snapshot_pool_ports[slot], self.snapshot_pool_pos[slot]) + pool_values
+        )
+        self.state_index.rebuild(self.state[:, 2])
+        self.attack_index.rebuild(self.attack_state[:, 0])
+
+    def evaluate_actions(self, state, action_thresholds, do_attack=True):
+        """
+        Outcome of every defence action applied to its own copy of the cluster, without changing the environment.
+        The attacker responds to all copies in one batch, and each copy draws the random numbers a real step would draw.
+        Returns the next states, the defence states, the defence success flags, messages and costs,
+        and the indicators of the defence states as a decider computes them after Env.step, one row per action.
+        """
+        n = self.defence_num
+        next_states = np.repeat(
+            np.asarray(state, dtype=np.int64)[np.newaxis], n, axis=0
+        )
+        defence_states = np.zeros_like(next_states)
+        attack_states = np.repeat(self.attack_state[np.newaxis], n, axis=0)
+        ser_num = np.full(n, self.ser_num, dtype=np.int64)
+        pod_remain = self.pod_max_num - np.sum(next_states[:, :, 0], axis=1)
+        pools = [self.port_pool.copy() for _ in range(n)]
+        defence_success = np.zeros(n, dtype=bool)
+        defence_fail_msgs = [None] * n
+        defence_costs = np.zeros(n, dtype=np.int64)
+        ports = {}
+
+        random_state = self.rng.get_state()
+        if not do_attack:
+            token = self.snapshot()
+            save_state, save_port_pool = self.state, self.port_pool
+        for action in range(n):
+            self.rng.set_state(random_state)
+            con_percent, mem_percent = action_thresholds[action]
+            batch = slice(action, action + 1)
+            success, fail_msgs, costs, action_ports = self.defender.step_batch(
+                map_action_to_defence[action],
+                {"con_percent": con_percent, "mem_percent": mem_percent},
+                next_states[batch],
+                attack_states[batch],
+                ser_num[batch],
+                pod_remain[batch],
+                pools[batch],
+            )
+            defence_states[action] = next_states[action]
+            defence_success[action] = success[0]
+            defence_fail_msgs[action] = fail_msgs[0]
+            defence_costs[action] = costs[0]
+            for key, value in action_ports.items():
+                ports.setdefault(key, np.zeros((n, value.shape[1]), dtype=np.int64))[
+                    action
+                ] = value[0]
+            if not do_attack:
+                # Silent for one round: the copy starts over with normal user traffic
+                self.state = next_states[action]
+                self.state[:] = 0
+                self.state_index.clear()
+                self.port_pool = pools[action]
+                self.port_pool.reset()
+                self.defender.reset()
+                ser_num[action] = self.ser_num
+        self.rng.set_state(random_state)
+
+        if do_attack:
+            self.attacker.step_batch(
+                next_states,
+                attack_states,
+                np.full(n, self.attacker.con_remain, dtype=np.int64),
+                np.full(n, self.attacker.mem_remain, dtype=np.int64),
+                ports,
+                ser_num,
+                self.steps_beyond_terminated,
+            )
+        else:
+            self.state, self.port_pool = save_state, save_port_pool
+            self.restore(token)
+
+        indicators = self.cal_indicators_batch(
+            defence_states, defence_costs, ser_num=ser_num
+        )
+        return (
+            next_states,
+            defence_states,
+            defence_success,
+            defence_fail_msgs,
+            defence_costs,
+            indicators,
+        )
+
     def change_attacker_num(self, num):
         if self.attacker.num == num:
             return
         self.attacker = attackerFactory(self, self.attacker.type, num)
         self.reset()
 
+    def _count_indicators(self, states):
+        # states: (..., ser_max_num, ser_ind); returns per-state counts and sums over active replicas
+        pods = states[..., 0]
+        con = states[..., 1]
+        mem = states[..., 3]
+        active = pods > 0
+        # con
+        con_danger = con > pods * self.pod_con_num * self.con_danger_thresh_percent
+        con_effective = ~con_danger & (
+            con < self.con_effective_thresh_percent * pods * self.pod_con_num
+        )
+        # mem
+        mem_danger = mem > pods * self.pod_mem_num * self.mem_danger_thresh_percent
+        mem_effective = ~mem_danger & (
+            mem < self.mem_effective_thresh_percent * pods * self.pod_mem_num
+        )
+        return (
+            np.count_nonzero(active & con_effective, axis=-1),  # inefficient services
+            np.count_nonzero(active & con_danger, axis=-1),  # dangerous services
+            np.count_nonzero(active & mem_effective, axis=-1),
+            np.count_nonzero(active & mem_danger, axis=-1),
+            np.sum(pods, axis=-1, where=active),  # pods of the service
+            np.sum(con, axis=-1, where=active),  # connections of the service
+            np.sum(mem, axis=-1, where=active),  # memory usage of the service
+        )
+
     def cal_indicators(self, state, cost=0):
-        con_effective_flag = 0  # Number of inefficient services
-        con_danger_flag = 0  # Number of dangerous services
-        mem_effective_flag = 0
-        mem_danger_flag = 0
-        pod_num = 0  # The number of pods for the service
-        pod_con_num = 0  # Number of connections for the service
-        pod_mem_num = 0  # Memory usage of the service
-        for i in range(self.ser_max_num):
-            if state[i][0] > 0:
-                pod_num += state[i][0]
-                pod_con_num += state[i][1]
-                pod_mem_num += state[i][3]
-                # con
-                if (
-                    state[i][1]
-                    > state[i][0] * self.pod_con_num * self.con_danger_thresh_percent
-                ):
-                    con_danger_flag += 1
-                elif (
-                    state[i][1]
-                    < self.con_effective_thresh_percent * state[i][0] * self.pod_con_num
-                ):
-                    con_effective_flag += 1
-                # mem
-                if (
-                    state[i][3]
-                    > state[i][0] * self.pod_mem_num * self.mem_danger_thresh_percent
-                ):
-                    mem_danger_flag += 1
-                elif (
-                    state[i][3]
-                    < self.mem_effective_thresh_percent * state[i][0] * self.pod_mem_num
-                ):
-                    mem_effective_flag += 1
-        C_e = con_effective_flag / self.ser_num  # Proportion of inefficient services
-        C_d = con_danger_flag / self.ser_num  # Proportion of dangerous services
-        M_e = mem_effective_flag / self.ser_num
-        M_d = mem_danger_flag / self.ser_num
+        (
+            con_effective_flag,
+            con_danger_flag,
+            mem_effective_flag,
+            mem_danger_flag,
+            pod_num,
+            pod_con_num,
+            pod_mem_num,
+        ) = self._count_indicators(state)
+        if pod_num == 0:
+            raise ZeroDivisionError("There are no active replicas in the service")
+        # Proportion of inefficient and dangerous services
+        C_e = int(con_effective_flag) / self.ser_num
+        C_d = int(con_danger_flag) / self.ser_num
+        M_e = int(mem_effective_flag) / self.ser_num
+        M_d = int(mem_danger_flag) / self.ser_num
         con_delay = pod_con_num / (pod_num * self.pod_con_num)  # Service delay
         mem_delay = pod_mem_num / (pod_num * self.pod_mem_num)
         indicators = Indicators(C_e, C_d, M_e, M_d, con_delay, mem_delay, cost)
         return indicators
 
+    def cal_indicators_batch(self, states, costs=0, ser_num=None):
+        """
+        Indicators of a stack of states (..., ser_max_num, ser_ind), e.g. candidate next states or all clusters of a batch.
+        ser_num defaults to the number of replicas holding a port in each state; clusters without active replicas give nan.
+        """
+        states = np.asarray(states)
+        (
+            con_effective_flag,
+            con_danger_flag,
+            mem_effective_flag,
+            mem_danger_flag,
+            pod_num,
+            pod_con_num,
+            pod_mem_num,
+        ) = self._count_indicators(states)
+        if ser_num is None:
+            ser_num = np.count_nonzero(states[..., 2], axis=-1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return IndicatorsBatch(
+                C_e=con_effective_flag / ser_num,
+                C_d=con_danger_flag / ser_num,
+                M_e=mem_effective_flag / ser_num,
+                M_d=mem_danger_flag / ser_num,
+                con_delay=pod_con_num / (pod_num * self.pod_con_num),
+                mem_delay=pod_mem_num / (pod_num * self.pod_mem_num),
+                cost=np.broadcast_to(costs, pod_num.shape).copy(),
+            )
+
     def cal_reward(
         self, success, defence_success, defence_indicators, success_num, fail_num
     ):
         alpha, beta, gamma, delta = 10, 1, 1, 5
-        success_flag = 1 if success else -1
-        defence_success_flag = 1 if defence_success else -1
+        # 1 or -1, also elementwise for arrays of flags
+        success_flag = 2 * success - 1
+        defence_success_flag = 2 * defence_success - 1
         time_cost = 2
         reward = (
             alpha * success_flag
@@ -175,7 +378,20 @@ class Env(gym.Env):
         return reward
 
     def get_state_index(self, port):
-        return self.state[:, 2].tolist().index(port)
+        if self.debug:
+            self.state_index.validate(self.state[:, 2])
+        if port in self.state_index:
+            return self.state_index.lookup(port)
+        return self.state[:, 2].tolist().index(port)  # empty rows and missing ports
 
     def get_attack_index(self, port):
+        if self.debug:
+            self.attack_index.validate(self.attack_state[:, 0])
+        if port in self.attack_index:
+            return self.attack_index.lookup(port)
         return self.attack_state[:, 0].tolist().index(port)
+
+    def validate_index(self):
+        self.state_index.validate(self.state[:, 2])
+        self.attack_index.validate(self.attack_state[:, 0])
+        self.port_pool.validate(self.state[:, 2])
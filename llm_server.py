@@ -0,0 +1,273 @@
+import argparse
+import ast
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from argparse import Namespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from constants import AttackerType, IndicatorsBatch
+from decider.greedy import Greedy
+from env import Env
+
+# Local stand-in for the chat completions API of OpenAI, answering the structured output requests
+# of the LLM decider, e.g. python llm_server.py --policy greedy --latency lognormal:0.5,0.5 --error_rate 0.05
+# and python main.py --decider_type LLM --llm_base_url http://127.0.0.1:8000/v1 ...
+
+
+def latency_sampler(spec, rng):
+    # "fixed:s", "uniform:low,high", "exponential:mean" or "lognormal:median,sigma" in seconds
+    kind, _, values = spec.partition(":")
+    values = [float(value) for value in values.split(",") if value]
+    if kind == "fixed":
+        return lambda: values[0]
+    elif kind == "uniform":
+        return lambda: rng.uniform(values[0], values[1])
+    elif kind == "exponential":
+        return lambda: rng.expovariate(1 / values[0])
+    elif kind == "lognormal":
+        return lambda: values[0] * rng.lognormvariate(0, values[1])
+    else:
+        raise ValueError(f"Invalid latency distribution {spec}")
+
+
+def find_outcomes(messages):
+    # The outcome table of the latest request that has one, in the full or the compact encoding
+    for message in reversed(messages):
+        content = message.get("content") or ""
+        start = content.find("'outcomes': [")
+        if start < 0:
+            continue
+        start += len("'outcomes': ")
+        depth = 0
+        for end in range(start, len(content)):
+            if content[end] == "[":
+                depth += 1
+            elif content[end] == "]":
+                depth -= 1
+                if depth == 0:
+                    break
+        text = re.sub(r"\b(inf|nan)\b", "1e999", content[start : end + 1])
+        outcomes = []
+        for outcome in ast.literal_eval(text):
+            if isinstance(outcome, dict):
+                outcome = [
+                    outcome["action"],
+                    outcome["defence_success"],
+                    outcome["success"],
+                ] + list(outcome["indicators"].values())
+            outcomes.append(outcome)
+        return outcomes
+    return None
+
+
+def greedy_action(outcomes, env):
+    # The action the greedy decider scores best with the reward of env, with equal success and fail counts,
+    # outcomes as [action, defence_success, success, C_e, C_d, M_e, M_d, con_delay, mem_delay, cost]
+    outcomes = np.array(outcomes, dtype=float)
+    scores, _, _ = Greedy.score(
+        env, outcomes[:, 1] > 0, IndicatorsBatch(*outcomes[:, 3:].T), 0, 0
+    )
+    if not np.any(np.isfinite(scores)):
+        return None
+    return int(outcomes[np.argmax(scores), 0])
+
+
+class Responder:
+    def __init__(self, policy="random", replay=None, seed=None):
+        self.policy = policy
+        self.rng = random.Random(seed)
+        # Scores the outcome tables like the simulator, only its reward is used
+        self.env = (
+            Env(Namespace(attacker_type=AttackerType.LDOS, attacker_num=0))
+            if policy == "greedy"
+            else None
+        )
+        self.lock = threading.Lock()
+        # Recorded responses of every response format, answered in order and again from the start when used up
+        self.replay = {}
+        self.replay_pos = {}
+        if replay is not None:
+            with open(replay, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self.replay.setdefault(record["response_format"], []).append(
+                            record["parsed"]
+                        )
+
+    def respond(self, name, messages):
+        with self.lock:
+            if self.policy == "replay" and self.replay.get(name):
+                pos = self.replay_pos.get(name, 0)
+                self.replay_pos[name] = pos + 1
+                return self.replay[name][pos % len(self.replay[name])]
+            if name != "Action":
+                return {"desc": f"Answer of the local {self.policy} policy."}
+            action = None
+            if self.policy == "greedy":
+                outcomes = find_outcomes(messages)
+                if outcomes:
+                    action = greedy_action(outcomes, self.env)
+            if action is None:
+                action = self.rng.randrange(6)
+            return {
+                "action": action,
+                "desc": f"Action of the local {self.policy} policy.",
+            }
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so clients reuse their connections
+
+    def do_POST(self):
+        server = self.server
+        request_id = next(server.request_ids)
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        time.sleep(server.latency())
+        if not self.path.endswith("/chat/completions"):
+            return self.send_json(404, {"error": {"message": "Not found"}})
+        if server.rng.random() < server.error_rate:
+            return self.send_json(
+                server.error_status,
+                {"error": {"message": "Injected error", "type": "server_error"}},
+            )
+
+        messages = body.get("messages", [])
+        name = body.get("response_format", {}).get("json_schema", {}).get("name")
+        content = json.dumps(server.responder.respond(name, messages))
+        prompt_tokens = sum(len(m.get("content") or "") // 4 + 4 for m in messages)
+        completion_tokens = len(content) // 4
+        self.send_json(
+            200,
+            {
+                "id": f"chatcmpl-local-{request_id}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {
+                            "role": "assistant",
+                            "content": content,
+                            "refusal": None,
+                        },
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            },
+        )
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def make_server(
+    host="127.0.0.1",
+    port=8000,
+    policy="random",
+    latency="fixed:0",
+    error_rate=0.0,
+    error_status=500,
+    replay=None,
+    seed=None,
+    verbose=False,
+):
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.rng = random.Random(seed)
+    server.latency = latency_sampler(latency, server.rng)
+    server.error_rate = error_rate
+    server.error_status = error_status
+    server.responder = Responder(policy, replay, seed)
+    server.request_ids = (
+        itertools.count()
+    )  # a request handler thread each, next is atomic
+    server.verbose = verbose
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="argparse")
+    parser.add_argument(
+        "--host", type=str, required=False, default="127.0.0.1", help="Host"
+    )
+    parser.add_argument("--port", type=int, required=False, default=8000, help="Port")
+    parser.add_argument(
+        "--policy",
+        type=str,
+        required=False,
+        default="random",
+        choices=["random", "greedy", "replay"],
+        help="How actions are chosen, greedy uses the outcome table of the prompt",
+    )
+    parser.add_argument(
+        "--replay",
+        type=str,
+        required=False,
+        default=None,
+        help="JSONL file of recorded responses for the replay policy",
+    )
+    parser.add_argument(
+        "--latency",
+        type=str,
+        required=False,
+        default="fixed:0",
+        help="Latency distribution, fixed:s, uniform:low,high, exponential:mean or lognormal:median,sigma",
+    )
+    parser.add_argument(
+        "--error_rate",
+        type=float,
+        required=False,
+        default=0.0,
+        help="Share of requests answered with an error",
+    )
+    parser.add_argument(
+        "--error_status",
+        type=int,
+        required=False,
+        default=500,
+        help="HTTP status of the injected errors, e.g. 429 or 500",
+    )
+    parser.add_argument(
+        "--seed", type=int, required=False, default=None, help="Random seed"
+    )
+    parser.add_argument(
+        "--verbose", type=bool, required=False, default=False, help="Log requests"
+    )
+
+    args = parser.parse_args()
+    server = make_server(
+        args.host,
+        args.port,
+        args.policy,
+        args.latency,
+        args.error_rate,
+        args.error_status,
+        args.replay,
+        args.seed,
+        args.verbose,
+    )
+    print(f"Serving the {args.policy} policy on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -1,6 +1,78 @@
-from .log import Logger
+from .log import Logger, in_background
+import hashlib
 import os
 import json
+import threading
+import pandas as pd
+
+
+class PromptJournal:
+    """
+    Append-only JSONL journal of the prompts and answers of an LLM agent, every line is one record:
+    {"type": "system", "hash", "messages"} once for every distinct list of system prompts,
+    {"type": "message", "episode", "index", "role", "content"} for every message of the prompt history as it is added,
+    {"type": "call", ...} for every answered request with its token counts, latency, system prompts hash and response.
+    Records are appended right away, or handed to write, e.g. LLMLogger.write_journal of a logger in background mode.
+    """
+
+    def __init__(self, path: str, write=None):
+        self.path = path
+        self.file = open(path, "a", encoding="utf-8")
+        self.lock = (
+            threading.Lock()
+        )  # answers of background requests are written by their threads
+        self.hashes = set()
+        self.write = self.append if write is None else write
+
+    def append(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False)
+        with self.lock:
+            self.file.write(line + "\n")
+
+    def system(self, messages: list) -> str:
+        hash = hashlib.sha256(
+            json.dumps(messages, sort_keys=True, ensure_ascii=False).encode("utf-8")
+        ).hexdigest()[:16]
+        if hash not in self.hashes:
+            self.hashes.add(hash)
+            self.write({"type": "system", "hash": hash, "messages": messages})
+        return hash
+
+    def message(self, episode: int, index: int, message: dict):
+        self.write({"type": "message", "episode": episode, "index": index, **message})
+
+    def call(self, tokens: dict, system: str, response: dict):
+        self.write({"type": "call", **tokens, "system": system, "response": response})
+
+    def flush(self):
+        with self.lock:
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def read_journal(path: str, types: tuple = None):
+    # Streams the records of a journal, of the given types only
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if types is None or record["type"] in types:
+                yield record
+
+
+def load_prompts(path: str, episode: int) -> list[dict]:
+    # The prompt history of an episode as the agent held it
+    messages = [
+        record
+        for record in read_journal(path, ("message",))
+        if record["episode"] == episode
+    ]
+    return [
+        {"role": record["role"], "content": record["content"]}
+        for record in sorted(messages, key=lambda record: record["index"])
+    ]
 
 
 class LLMLogger(Logger):
@@ -11,11 +83,30 @@ class LLMLogger(Logger):
         log_dir: str = "log",
         txt_dir: str = "txt",
         prompts_dir: str = "prompts",
+        output_dir: str = "output",
+        background: bool = False,
+        queue_size: int = 16,
+        backend: str = "tensorboard",
+        flush_secs: float = 10,
     ):
-        super().__init__(prefix, title, log_dir, txt_dir)
+        super().__init__(
+            prefix,
+            title,
+            log_dir,
+            txt_dir,
+            output_dir,
+            background,
+            queue_size,
+            backend,
+            flush_secs,
+        )
         prompts_path = f"{self.dir_path}/{prefix}-{title}/{prompts_dir}"
         self.init_prompts(prompts_path)
 
+    def flush(self):
+        super().flush()
+        self.journal.flush()
+
     def close(self):
         super().close()
         self.close_prompts()
@@ -25,11 +116,21 @@ class LLMLogger(Logger):
         if not os.path.exists(prompts_path):
             os.makedirs(prompts_path)
         self.prompts_path = prompts_path
+        self.journal = PromptJournal(
+            f"{prompts_path}/journal.jsonl", self.write_journal
+        )
+
+    @in_background
+    def write_journal(self, record: dict):
+        self.journal.append(record)
+
+    @in_background
+    def write_tokens(self, token_counts: list[dict]):
+        pd.DataFrame(token_counts).to_csv(f"{self.log_path}/tokens.csv", index=False)
 
-    def write_prompts(self, episode: int, prompts: list):
-        prompts_path = f"{self.prompts_path}/{episode}.json"
-        with open(prompts_path, "w", encoding="utf-8") as f:
-            json.dump(prompts, f, ensure_ascii=False, indent=2)
+    @in_background
+    def write_deadline(self, records: list[dict]):
+        pd.DataFrame(records).to_csv(f"{self.log_path}/deadline.csv", index=False)
 
     def close_prompts(self):
-        pass
+        self.journal.close()
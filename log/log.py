@@ -1,6 +1,23 @@
+import atexit
+import functools
 import os
-from torch.utils.tensorboard import SummaryWriter
-import pandas as pd
+import queue
+import threading
+import time
+from .scalar import new_scalar_writer
+from .trajectory import TrajectoryWriter
+
+
+def in_background(method):
+    # In background mode the write is queued and made by the writer thread of the logger,
+    # so its arguments must not be changed by the caller afterwards
+    @functools.wraps(method)
+    def write(self, *args, **kwargs):
+        if self.queue is None or threading.current_thread() is self.writer:
+            return method(self, *args, **kwargs)
+        self.put(method, args, kwargs)
+
+    return write
 
 
 class Logger:
@@ -10,27 +27,106 @@ class Logger:
         title: str,
         log_dir: str = "log",
         txt_dir: str = "txt",
+        output_dir: str = "output",
+        background: bool = False,
+        queue_size: int = 16,
+        backend: str = "tensorboard",
+        flush_secs: float = 10,
     ):
-        self.dir_path = f"{os.getcwd()}/output"
+        self.dir_path = os.path.join(os.getcwd(), output_dir)
         log_path = f"{self.dir_path}/{prefix}-{title}/{log_dir}"
         txt_path = f"{self.dir_path}/{prefix}-{title}/{txt_dir}"
-        self.init_log(log_path)
+        self.init_log(log_path, backend, flush_secs)
         self.init_txt(txt_path)
+        self.queue = None
+        self.writer = None
+        if background:
+            self.init_writer(queue_size)
+        # Writes still queued or buffered when the run ends with an exception are made before the interpreter exits
+        atexit.register(self.flush)
+
+    def flush(self):
+        self.close_writer()
+        self.trajectory.flush()
+        self.scalars.flush()
 
     def close(self):
+        atexit.unregister(self.flush)
+        self.close_writer()
         self.close_log()
         self.close_txt()
 
+    # writer thread
+    def init_writer(self, queue_size: int):
+        # A full queue blocks the writes of the caller, the time it waited is reported as backpressure
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.writer_error = None
+        self.stats_lock = threading.Lock()  # writes are also queued by the request threads of the LLM decider
+        self.writer_stats = {
+            "writes": 0,
+            "max_queued": 0,
+            "blocked_time": 0.0,
+            "write_time": 0.0,
+        }
+        self.writer = threading.Thread(target=self.run_writer, daemon=True)
+        self.writer.start()
+
+    def put(self, method, args, kwargs):
+        if self.writer_error is not None:
+            raise self.writer_error
+        start = time.perf_counter()
+        self.queue.put((method, args, kwargs))
+        with self.stats_lock:
+            self.writer_stats["blocked_time"] += time.perf_counter() - start
+            self.writer_stats["writes"] += 1
+            self.writer_stats["max_queued"] = max(
+                self.writer_stats["max_queued"], self.queue.qsize()
+            )
+
+    def run_writer(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            method, args, kwargs = item
+            start = time.perf_counter()
+            try:
+                method(self, *args, **kwargs)
+            except Exception as error:
+                self.writer_error = error
+            with self.stats_lock:
+                self.writer_stats["write_time"] += time.perf_counter() - start
+
+    def close_writer(self):
+        if self.writer is None:
+            return
+        self.queue.put(None)
+        self.writer.join()
+        self.writer = None
+        self.queue = None
+        print("logger writer", self.writer_stats)
+        if self.writer_error is not None:
+            raise self.writer_error
+
     # log
-    def init_log(self, log_path: str):
+    def init_log(
+        self, log_path: str, backend: str = "tensorboard", flush_secs: float = 10
+    ):
         if not os.path.exists(log_path):
             os.makedirs(log_path)
         self.log_path = log_path
-        self.log_survival_rate = SummaryWriter(f"{log_path}")
-        self.log_convergence_episode = SummaryWriter(f"{log_path}")
-        self.log_success_list = SummaryWriter(f"{log_path}")
-        self.log_step_num_list = SummaryWriter(f"{log_path}")
+        # One writer for every tag, scalars are streamed during the run and flushed every flush_secs
+        self.scalars = new_scalar_writer(f"{log_path}", backend, flush_secs)
+        self.scalar_step = 0
+        self.logged_episodes = set()
 
+    @in_background
+    def write_episode(self, episode: int, scalars: dict):
+        for tag, value in scalars.items():
+            self.scalars.add_scalar(tag, value, episode)
+        self.logged_episodes.add(episode)
+
+    @in_background
     def write_log(
         self,
         num_episodes: int,
@@ -39,15 +135,16 @@ class Logger:
         success_list: list,
         step_num_list: list
     ):
+        import pandas as pd
+
+        # episodes not streamed by write_episode
         for i in range(num_episodes):
-            self.log_survival_rate.add_scalar("survival_rate", survival_rate[i], i)
-            self.log_success_list.add_scalar("success_list", success_list[i], i)
-            self.log_step_num_list.add_scalar(
-                "step_num_list", step_num_list[i], i
-            )
-        self.log_convergence_episode.add_scalar(
-            "convergence_episode", convergence_episode
-        )
+            if i in self.logged_episodes:
+                continue
+            self.scalars.add_scalar("survival_rate", survival_rate[i], i)
+            self.scalars.add_scalar("success_list", success_list[i], i)
+            self.scalars.add_scalar("step_num_list", step_num_list[i], i)
+        self.scalars.add_scalar("convergence_episode", convergence_episode)
         # save to csv
         df = pd.DataFrame(
             {
@@ -60,23 +157,35 @@ class Logger:
         df.to_csv(f"{self.log_path}/log.csv", index=False)
 
     def close_log(self):
-        self.log_survival_rate.close()
-        self.log_convergence_episode.close()
-        self.log_success_list.close()
-        self.log_step_num_list.close()
+        self.scalars.close()
 
     # txt
     def init_txt(self, txt_path: str):
         if not os.path.exists(txt_path):
             os.makedirs(txt_path)
         self.txt_path = txt_path
+        self.trajectory = TrajectoryWriter(txt_path)
 
+    @in_background
     def write_txt(self, episode: int, txt_datas: list[dict]):
-        for txt_data in txt_datas:
-            for key, value in txt_data.items():
-                file_path = os.path.join(self.txt_path, f"{key}.csv")
-                with open(file_path, "a", encoding="utf-8") as f:
-                    f.write(f"{value}\n")
+        # buffered, see log.trajectory.load_trajectory to read the steps back
+        for step, txt_data in enumerate(txt_datas):
+            self.trajectory.append(episode, step, txt_data)
+
+    @in_background
+    def write_step(self, success, defence_success, defence_indicators):
+        # scalars of every step as soon as it is judged, numbered across the episodes of the run
+        scalars = {
+            "step/success": float(success),
+            "step/defence_success": float(defence_success),
+            **{
+                f"step/{name}": getattr(defence_indicators, name)
+                for name in ("cost", "con_delay", "mem_delay")
+            },
+        }
+        for tag, value in scalars.items():
+            self.scalars.add_scalar(tag, value, self.scalar_step)
+        self.scalar_step += 1
 
     def close_txt(self):
-        pass
+        self.trajectory.close()
@@ -0,0 +1,55 @@
+import csv
+import os
+import time
+
+
+class ScalarWriter:
+    """
+    Lightweight stand-in for the SummaryWriter of TensorBoard, appends the scalars to scalars.csv in log_dir
+    as tag, step, value and wall time every flush_secs, like SummaryWriter, and when it is flushed or closed.
+    """
+
+    def __init__(self, log_dir, flush_secs=10):
+        self.path = os.path.join(log_dir, "scalars.csv")
+        self.flush_secs = flush_secs
+        self.rows = []
+        self.flush_time = time.time()
+
+    def add_scalar(self, tag, scalar_value, global_step=None, walltime=None):
+        self.rows.append(
+            (
+                tag,
+                global_step,
+                float(scalar_value),
+                time.time() if walltime is None else walltime,
+            )
+        )
+        if time.time() - self.flush_time >= self.flush_secs:
+            self.flush()
+
+    def flush(self):
+        self.flush_time = time.time()
+        if not self.rows:
+            return
+        header = not os.path.exists(self.path)
+        with open(self.path, "a", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            if header:
+                writer.writerow(["tag", "step", "value", "wall_time"])
+            writer.writerows(self.rows)
+        self.rows = []
+
+    def close(self):
+        self.flush()
+
+
+def new_scalar_writer(log_dir, backend="tensorboard", flush_secs=10):
+    # TensorBoard is imported when it is used, a ScalarWriter takes its place without torch
+    if backend == "tensorboard":
+        try:
+            from torch.utils.tensorboard import SummaryWriter
+
+            return SummaryWriter(log_dir, flush_secs=flush_secs)
+        except ImportError:
+            print("TensorBoard is not available, scalars are written to scalars.csv")
+    return ScalarWriter(log_dir, flush_secs)
@@ -0,0 +1,93 @@
+import os
+from dataclasses import fields
+from glob import glob
+import numpy as np
+from constants import Indicators
+
+INDICATORS = [f.name for f in fields(Indicators)]
+
+# Columns of the trajectory of a run, one row per step
+SCHEMA = {
+    "episode": np.int32,
+    "step": np.int32,
+    "action": np.int8,
+    "con_percent": np.float32,
+    "mem_percent": np.float32,
+    **{f"attack_{name}": np.float64 for name in INDICATORS},
+    **{f"defence_{name}": np.float64 for name in INDICATORS},
+    "defence_success": np.bool_,
+    "defence_fail_msg": np.str_,
+    "success": np.bool_,
+    "fail_msg": np.str_,
+}
+
+
+class TrajectoryWriter:
+    """
+    Buffers the steps of a run and writes them as typed columns of SCHEMA to numbered .npz chunks
+    of chunk_size rows in path, read back by load_trajectory.
+    """
+
+    def __init__(self, path, chunk_size=4096):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.chunk_num = len(glob(os.path.join(path, "trajectory-*.npz")))
+        self.rows = []
+
+    def append(self, episode, step, txt_data):
+        # txt_data is the step as written by the train loops of the deciders
+        action, con_percent, mem_percent = txt_data["action"]
+        attack_indicators, defence_indicators = txt_data["indicators"]
+        defence_success, defence_fail_msg = txt_data["defence_msg"]
+        success, fail_msg = txt_data["success"]
+        self.rows.append(
+            (
+                episode,
+                step,
+                action,
+                con_percent,
+                mem_percent,
+                *(attack_indicators[name] for name in INDICATORS),
+                *(defence_indicators[name] for name in INDICATORS),
+                bool(defence_success),
+                defence_fail_msg or "",
+                bool(success),
+                fail_msg or "",
+            )
+        )
+        if len(self.rows) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        columns = zip(*self.rows)
+        np.savez(
+            os.path.join(self.path, f"trajectory-{self.chunk_num:05d}.npz"),
+            **{
+                name: np.array(column, dtype=dtype)
+                for (name, dtype), column in zip(SCHEMA.items(), columns)
+            },
+        )
+        self.chunk_num += 1
+        self.rows = []
+
+    def close(self):
+        self.flush()
+
+
+def load_trajectory(path):
+    # The trajectory of a run as a DataFrame, path is the run directory or its txt directory
+    import pandas as pd
+
+    if not glob(os.path.join(path, "trajectory-*.npz")):
+        path = os.path.join(path, "txt")
+    chunks = []
+    for chunk_path in sorted(glob(os.path.join(path, "trajectory-*.npz"))):
+        with np.load(chunk_path) as chunk:
+            chunks.append(pd.DataFrame({name: chunk[name] for name in SCHEMA}))
+    if not chunks:
+        return pd.DataFrame(
+            {name: np.array([], dtype=dtype) for name, dtype in SCHEMA.items()}
+        )
+    return pd.concat(chunks, ignore_index=True)
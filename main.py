@@ -1,14 +1,18 @@
 import argparse
+import random
 from argparse import Namespace
+import numpy as np
 from env import Env
+from vector_env import VectorEnv
 from decider.decider import deciderFactory
 from constants import (
+    DeciderType,
     check_attacker_type,
     check_decider_type,
 )
 
 
-if __name__ == "__main__":
+def parse_args(argv=None):
     # Create the parser
     parser = argparse.ArgumentParser(description="argparse")
 
@@ -60,6 +64,162 @@ if __name__ == "__main__":
         help="Changed attacker num",
     )
 
+    parser.add_argument(
+        "--lookahead_depth",
+        type=int,
+        required=False,
+        default=1,
+        help="Steps looked ahead by the greedy decider",
+    )
+    parser.add_argument(
+        "--beam_width",
+        type=int,
+        required=False,
+        default=3,
+        help="Lookahead branches kept by the greedy decider",
+    )
+
+    parser.add_argument(
+        "--num_envs",
+        type=int,
+        required=False,
+        default=1,
+        help="Number of clusters simulated together in one vectorized environment",
+    )
+
+    parser.add_argument(
+        "--max_concurrency",
+        type=int,
+        required=False,
+        default=8,
+        help="Max number of LLM requests in flight when runs are concurrent",
+    )
+
+    parser.add_argument(
+        "--reflection",
+        type=str,
+        required=False,
+        default="background",
+        choices=["sync", "background", "skip"],
+        help="How the LLM decider makes its step reflection requests",
+    )
+
+    parser.add_argument(
+        "--history_steps",
+        type=int,
+        required=False,
+        default=None,
+        help="Steps of the episode sent verbatim to the LLM, older steps are summarized",
+    )
+    parser.add_argument(
+        "--max_prompt_tokens",
+        type=int,
+        required=False,
+        default=None,
+        help="Estimated prompt tokens above which fewer steps are sent verbatim",
+    )
+    parser.add_argument(
+        "--max_listed_actions",
+        type=int,
+        required=False,
+        default=None,
+        help="Max number of earlier action sequences listed in prompts",
+    )
+
+    parser.add_argument(
+        "--cache_size",
+        type=int,
+        required=False,
+        default=0,
+        help="Max number of states whose LLM decision is cached, 0 disables the cache",
+    )
+    parser.add_argument(
+        "--cache_buckets",
+        type=int,
+        required=False,
+        default=10,
+        help="Number of load rate buckets of the decision cache",
+    )
+    parser.add_argument(
+        "--cache_history",
+        type=int,
+        required=False,
+        default=2,
+        help="Number of previous actions in the key of the decision cache",
+    )
+    parser.add_argument(
+        "--cache_policy",
+        type=str,
+        required=False,
+        default="success",
+        choices=["success", "all"],
+        help="Cache only the decisions of successful steps or all decisions",
+    )
+
+    parser.add_argument(
+        "--encoding",
+        type=str,
+        required=False,
+        default="full",
+        choices=["full", "compact"],
+        help="How service states and indicators are written into LLM prompts",
+    )
+
+    parser.add_argument(
+        "--llm_model",
+        type=str,
+        required=False,
+        default="gpt-4o-mini",
+        help="Model of the LLM decider",
+    )
+    parser.add_argument(
+        "--llm_base_url",
+        type=str,
+        required=False,
+        default=None,
+        help="Base URL of an OpenAI compatible API, e.g. http://127.0.0.1:8000/v1 of llm_server.py",
+    )
+
+    parser.add_argument(
+        "--llm_store",
+        type=str,
+        required=False,
+        default=None,
+        help="JSONL file of recorded LLM responses",
+    )
+    parser.add_argument(
+        "--llm_store_mode",
+        type=str,
+        required=False,
+        default="record",
+        choices=["record", "replay", "replay_or_call"],
+        help="Record the LLM responses, replay them or replay them and make the missing requests",
+    )
+
+    parser.add_argument(
+        "--llm_deadline",
+        type=float,
+        required=False,
+        default=None,
+        help="Seconds the LLM decider waits for an action before it takes the action of the fallback policy",
+    )
+    parser.add_argument(
+        "--llm_fallback",
+        type=str,
+        required=False,
+        default="greedy",
+        choices=["cache", "greedy", "rule"],
+        help="Fallback policy of actions that miss the LLM deadline",
+    )
+
+    parser.add_argument(
+        "--policy_path",
+        type=str,
+        required=False,
+        default="policy.json",
+        help="Policy of the DISTILLED decider, written by distill.py",
+    )
+
     parser.add_argument(
         "--enable_log",
         type=bool,
@@ -67,6 +227,49 @@ if __name__ == "__main__":
         default=False,
         help="Enable log or not",
     )
+    parser.add_argument(
+        "--log_background",
+        type=bool,
+        required=False,
+        default=False,
+        help="Write logs from a background thread",
+    )
+    parser.add_argument(
+        "--log_backend",
+        type=str,
+        required=False,
+        default="tensorboard",
+        choices=["tensorboard", "csv"],
+        help="Writer of the logged scalars, csv needs no torch",
+    )
+    parser.add_argument(
+        "--log_flush_secs",
+        type=float,
+        required=False,
+        default=10,
+        help="Seconds between flushes of the scalars streamed during the run",
+    )
+    parser.add_argument(
+        "--port_seed",
+        type=int,
+        required=False,
+        default=None,
+        help="Seed of the service port allocator",
+    )
+    parser.add_argument(
+        "--port_reuse_window",
+        type=int,
+        required=False,
+        default=0,
+        help="Number of later port releases before a released port can be reused",
+    )
+    parser.add_argument(
+        "--debug",
+        type=bool,
+        required=False,
+        default=False,
+        help="Validate the port indexes against the cluster state and print the messages of every step",
+    )
     parser.add_argument(
         "--prefix",
         type=str,
@@ -74,8 +277,24 @@ if __name__ == "__main__":
         default="default",
         help="Prefix of the log file",
     )
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        required=False,
+        default="output",
+        help="Directory of the log files",
+    )
+    parser.add_argument(
+        "--seed", type=int, required=False, default=None, help="Random seed"
+    )
+
+    return parser.parse_args(argv)
 
-    args = parser.parse_args()
+
+def run(args):
+    if args.seed is not None:
+        random.seed(args.seed)
+        np.random.seed(args.seed)
 
     # check the type of the attacker and the decider
     attacker_type = check_attacker_type(args.attacker_type)
@@ -85,6 +304,9 @@ if __name__ == "__main__":
     env_args = Namespace(
         attacker_type=attacker_type,
         attacker_num=args.attacker_num,
+        port_seed=args.port_seed,
+        port_reuse_window=args.port_reuse_window,
+        debug=args.debug,
     )
     env = Env(env_args)
 
@@ -100,13 +322,101 @@ if __name__ == "__main__":
 
     # create the decider
     decider = deciderFactory(decider_type)
-    decider.train_and_test(
-        env=env,
-        prefix=prefix,
-        num_episodes=args.num_episodes,
-        max_episode_step=args.max_episode_step,
-        attack_sequence=attack_sequence,
-        max_fail_num=args.max_fail_num,
-        enable_log=args.enable_log,
-        change_num=args.change_num,
-    )
+    # Settings that only apply to one decider
+    decider_options = {}
+    if decider_type == DeciderType.GREEDY:
+        decider_options = {"depth": args.lookahead_depth, "beam_width": args.beam_width}
+    elif decider_type == DeciderType.LLM:
+        decider_options = {
+            "reflection": args.reflection,
+            "history_steps": args.history_steps,
+            "max_prompt_tokens": args.max_prompt_tokens,
+            "max_listed_actions": args.max_listed_actions,
+            "cache_size": args.cache_size,
+            "cache_buckets": args.cache_buckets,
+            "cache_history": args.cache_history,
+            "cache_policy": args.cache_policy,
+            "encoding": args.encoding,
+            "model": args.llm_model,
+            "base_url": args.llm_base_url,
+            "store_path": args.llm_store,
+            "store_mode": args.llm_store_mode,
+            "deadline": args.llm_deadline,
+            "fallback": args.llm_fallback,
+        }
+    elif decider_type == DeciderType.DISTILLED:
+        decider_options = {"policy_path": args.policy_path}
+
+    if args.num_envs > 1 and hasattr(decider, "train_and_test_concurrent"):
+        # Independent runs, one per cluster, each drawing its ports from its own seed
+        envs = [env]
+        for i in range(1, args.num_envs):
+            run_args = Namespace(**vars(env_args))
+            if args.port_seed is not None:
+                run_args.port_seed = args.port_seed + i
+            envs.append(Env(run_args))
+        return decider.train_and_test_concurrent(
+            envs=envs,
+            prefix=prefix,
+            output_dir=args.output_dir,
+            log_background=args.log_background,
+            log_backend=args.log_backend,
+            log_flush_secs=args.log_flush_secs,
+            num_episodes=args.num_episodes,
+            max_episode_step=args.max_episode_step,
+            attack_sequence=attack_sequence,
+            max_fail_num=args.max_fail_num,
+            enable_log=args.enable_log,
+            change_num=args.change_num,
+            max_concurrency=args.max_concurrency,
+            **decider_options,
+        )
+    elif args.num_envs > 1:
+        if not hasattr(decider, "train_and_test_vector"):
+            raise ValueError(
+                f"Decider {args.decider_type} does not support vectorized environments"
+            )
+        if args.change_num != 0:
+            raise ValueError("change_num is not supported with vectorized environments")
+        if args.lookahead_depth > 1:
+            raise ValueError(
+                "lookahead_depth > 1 is not supported with vectorized environments"
+            )
+        vector_env = VectorEnv(
+            env_args,
+            args.num_envs,
+            attack_sequence,
+            max_fail_num=args.max_fail_num,
+            max_episode_step=args.max_episode_step,
+        )
+        return decider.train_and_test_vector(
+            env=vector_env,
+            prefix=prefix,
+            output_dir=args.output_dir,
+            log_background=args.log_background,
+            log_backend=args.log_backend,
+            log_flush_secs=args.log_flush_secs,
+            num_episodes=args.num_episodes,
+            max_fail_num=args.max_fail_num,
+            enable_log=args.enable_log,
+        )
+    else:
+        return decider.train_and_test(
+            env=env,
+            prefix=prefix,
+            output_dir=args.output_dir,
+            log_background=args.log_background,
+            log_backend=args.log_backend,
+            log_flush_secs=args.log_flush_secs,
+            num_episodes=args.num_episodes,
+            max_episode_step=args.max_episode_step,
+            attack_sequence=attack_sequence,
+            max_fail_num=args.max_fail_num,
+            enable_log=args.enable_log,
+            change_num=args.change_num,
+            **decider_options,
+        )
+
+
+if __name__ == "__main__":
+    run(parse_args())
@@ -0,0 +1,56 @@
+class PortIndex:
+    """
+    Port -> row index of one port column (state[:, 2] or attack_state[:, 0]).
+    A port resolves to the first row holding it, like list.index on the column; empty rows (port 0) are not indexed.
+    Callers update it for every row whose port they change, so lookups and membership tests are constant time.
+    """
+
+    def __init__(self):
+        self.rows = {}  # port -> first row holding the port
+        self.ports = {}  # row -> port
+        self.counts = {}  # port -> number of rows holding the port
+
+    def __contains__(self, port):
+        return port in self.rows
+
+    def lookup(self, port):
+        return self.rows[port]
+
+    def clear(self):
+        self.rows.clear()
+        self.ports.clear()
+        self.counts.clear()
+
+    def rebuild(self, ports):
+        self.clear()
+        for row, port in enumerate(ports.tolist()):
+            self.set(row, port)
+
+    def set(self, row, port):
+        port = int(port)
+        old = self.ports.pop(row, 0)
+        if old:
+            self.counts[old] -= 1
+            if self.counts[old] == 0:
+                del self.counts[old]
+                del self.rows[old]
+            elif self.rows[old] == row:
+                # The port is still held by another row, which becomes the first one
+                self.rows[old] = min(r for r, p in self.ports.items() if p == old)
+        if port:
+            self.ports[row] = port
+            self.counts[port] = self.counts.get(port, 0) + 1
+            if row < self.rows.get(port, row + 1):
+                self.rows[port] = row
+
+    def sync(self, ports, rows):
+        # Re-read the given rows of the port column after a batched update
+        for row in rows:
+            self.set(row, ports[row])
+
+    def validate(self, ports):
+        expected = PortIndex()
+        expected.rebuild(ports)
+        assert (
+            self.rows == expected.rows and self.ports == expected.ports
+        ), f"Port index {self.rows} is out of sync with the ports {ports.tolist()}"
@@ -0,0 +1,146 @@
+from collections import deque
+from copy import deepcopy
+import numpy as np
+
+
+class PortPool:
+    """
+    Service ports of one cluster, [low, high) as in np.random.randint(low, high).
+    Free ports are kept at the front of a permutation of the range, so a uniformly drawn free port is handed out
+    and a port is given back in constant time. With reuse_window > 0 a released port is only handed out again
+    after reuse_window further ports have been released, e.g. a port abandoned by port hopping is not reused right away.
+    """
+
+    def __init__(self, low=30000, high=32767, reuse_window=0, seed=None, rng=None):
+        self.low = low
+        self.high = high
+        self.reuse_window = reuse_window
+        self.shared_rng = np.random if rng is None else rng
+        self.seed(seed)
+        self.reset()
+        self.journal = None  # swaps since begin(), undone by rollback()
+
+    def seed(self, seed=None):
+        # Without a seed the ports are drawn from shared_rng, the global numpy random state by default
+        self.rng = None if seed is None else np.random.RandomState(seed)
+
+    def reset(self):
+        self.ports = np.arange(self.low, self.high)  # free ports first, then used ones
+        self.pos = np.arange(self.high - self.low)  # position of each port in ports
+        self.free_num = self.high - self.low
+        self.recent = deque()  # released ports waiting for the reuse window
+
+    def _swap(self, i, j):
+        if self.journal is not None:
+            self.journal.append((i, j))
+        pi, pj = self.ports[i], self.ports[j]
+        self.ports[i], self.ports[j] = pj, pi
+        self.pos[pi - self.low], self.pos[pj - self.low] = j, i
+
+    def _take(self, port):
+        i = self.pos[port - self.low]
+        if i < self.free_num:
+            self.free_num -= 1
+            self._swap(i, self.free_num)
+
+    def _give(self, port):
+        i = self.pos[port - self.low]
+        if i >= self.free_num:
+            self._swap(i, self.free_num)
+            self.free_num += 1
+
+    def _uniform(self, num=None):
+        return (self.shared_rng if self.rng is None else self.rng).random_sample(num)
+
+    def alloc(self):
+        if self.free_num == 0:
+            raise RuntimeError("There are no free ports left")
+        i = int(self._uniform() * self.free_num)
+        port = int(self.ports[i])
+        self.free_num -= 1
+        self._swap(i, self.free_num)
+        return port
+
+    def alloc_many(self, num):
+        # Distinct ports, e.g. the new ports of all replicas in one hop, from a single draw of random numbers
+        if num > self.free_num:
+            raise RuntimeError("There are no free ports left")
+        ports = np.empty(num, dtype=np.int64)
+        for k, u in enumerate(self._uniform(num).tolist()):
+            i = int(u * self.free_num)
+            ports[k] = self.ports[i]
+            self.free_num -= 1
+            self._swap(i, self.free_num)
+        return ports
+
+    def free(self, port):
+        port = int(port)
+        if port == 0:
+            return
+        if self.reuse_window > 0:
+            self.recent.append(port)
+            if len(self.recent) <= self.reuse_window:
+                return
+            port = self.recent.popleft()
+        self._give(port)
+
+    def free_many(self, ports):
+        for port in ports:
+            self.free(port)
+
+    def rebuild(self, ports):
+        # Mark the nonzero ports as used, forgetting the reuse window
+        self.reset()
+        for port in ports.tolist():
+            if port:
+                self._take(port)
+
+    def save(self, ports=None, pos=None):
+        # Copies the permutation into the given buffers when they are preallocated
+        if ports is None:
+            ports, pos = self.ports.copy(), self.pos.copy()
+        else:
+            np.copyto(ports, self.ports)
+            np.copyto(pos, self.pos)
+        rng_state = None if self.rng is None else self.rng.get_state()
+        return ports, pos, self.free_num, tuple(self.recent), rng_state
+
+    def load(self, saved):
+        ports, pos, self.free_num, recent, rng_state = saved
+        np.copyto(self.ports, ports)
+        np.copyto(self.pos, pos)
+        self.recent = deque(recent)
+        if rng_state is not None:
+            self.rng.set_state(rng_state)
+
+    def begin(self):
+        # Start recording changes, e.g. to try a defence on this pool and undo it in time proportional to the changes
+        rng_state = None if self.rng is None else self.rng.get_state()
+        self.journal = []
+        self.begin_values = (self.free_num, tuple(self.recent), rng_state)
+
+    def rollback(self):
+        journal, self.journal = self.journal, None
+        for i, j in reversed(journal):
+            self._swap(i, j)
+        self.free_num, recent, rng_state = self.begin_values
+        self.recent = deque(recent)
+        if rng_state is not None:
+            self.rng.set_state(rng_state)
+
+    def copy(self):
+        # An independent pool that draws the same ports as this one would
+        pool = PortPool.__new__(PortPool)
+        pool.__dict__.update(self.__dict__)
+        pool.rng = deepcopy(self.rng)
+        pool.ports = self.ports.copy()
+        pool.pos = self.pos.copy()
+        pool.recent = self.recent.copy()
+        return pool
+
+    def validate(self, ports):
+        used = set(self.ports[self.free_num :].tolist())
+        expected = {port for port in ports.tolist() if port} | set(self.recent)
+        assert (
+            used == expected
+        ), f"Port pool {sorted(used)} is out of sync with the ports {ports.tolist()}"
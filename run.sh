@@ -1,22 +1,20 @@
-# survival_rate and step_num
-python main.py --num_episodes 10 --max_fail_num 5 --attack_begin True --attack_sequence 10 --decider_type LLM --attacker_type LDOS --attacker_num 50 --change_num 0 --enable_log True --prefix survival_rate
+# Every sweep writes output/<name>/<decider_type>-<attacker_num>-<change_num>-seed<seed>/ per run and output/<name>/summary.csv
+# of all completed runs under output/<name>, completed runs are skipped when a sweep is started again
+COMMON="--num_episodes 10 --max_fail_num 5 --attack_begin True --attack_sequence 10 --attacker_type LDOS"
+WORKERS=4
 
-python main.py --num_episodes 10 --max_fail_num 5 --attack_begin True --attack_sequence 10 --decider_type RANDOM --attacker_type LDOS --attacker_num 50 --change_num 0 --enable_log True --prefix survival_rate
+# survival_rate and step_num
+python sweep.py --name survival_rate --decider_types LLM RANDOM --attacker_nums 50 --change_nums 0 --workers $WORKERS $COMMON
 
 # convergence_episode
-python main.py --num_episodes 10 --max_fail_num 5 --attack_begin True --attack_sequence 10 --decider_type LLM --attacker_type LDOS --attacker_num 10 --change_num 0 --enable_log True --prefix convergence_episode
-
-python main.py --num_episodes 10 --max_fail_num 5 --attack_begin True --attack_sequence 10 --decider_type LLM --attacker_type LDOS --attacker_num 20 --change_num 0 --enable_log True --prefix convergence_episode
-
-python main.py --num_episodes 10 --max_fail_num 5 --attack_begin True --attack_sequence 10 --decider_type LLM --attacker_type LDOS --attacker_num 30 --change_num 0 --enable_log True --prefix convergence_episode
-
-python main.py --num_episodes 10 --max_fail_num 5 --attack_begin True --attack_sequence 10 --decider_type LLM --attacker_type LDOS --attacker_num 40 --change_num 0 --enable_log True --prefix convergence_episode
-
-python main.py --num_episodes 10 --max_fail_num 5 --attack_begin True --attack_sequence 10 --decider_type LLM --attacker_type LDOS --attacker_num 50 --change_num 0 --enable_log True --prefix convergence_episode
+python sweep.py --name convergence_episode --decider_types LLM --attacker_nums 10 20 30 40 50 --change_nums 0 --workers $WORKERS $COMMON
 
-python main.py --num_episodes 10 --max_fail_num 5 --attack_begin True --attack_sequence 10 --decider_type RANDOM --attacker_type LDOS --attacker_num 10 --change_num 0 --enable_log True --prefix convergence_episode
+python sweep.py --name convergence_episode --decider_types RANDOM --attacker_nums 10 --change_nums 0 --workers $WORKERS $COMMON
 
 # migration_sucess_rate
-python main.py --num_episodes 10 --max_fail_num 5 --attack_begin True --attack_sequence 10 --decider_type LLM --attacker_type LDOS --attacker_num 20 --change_num 50 --enable_log True --prefix migration_sucess_rate
+python sweep.py --name migration_sucess_rate --decider_types LLM RANDOM --attacker_nums 20 --change_nums 50 --workers $WORKERS $COMMON
 
-python main.py --num_episodes 10 --max_fail_num 5 --attack_begin True --attack_sequence 10 --decider_type RANDOM --attacker_type LDOS --attacker_num 20 --change_num 50 --enable_log True --prefix migration_sucess_rate
+# distilled policy of the LLM runs, compared to them
+python distill.py --runs output/survival_rate --policy output/policy.json
+python sweep.py --name distilled --decider_types DISTILLED --attacker_nums 50 --change_nums 0 --workers $WORKERS $COMMON --policy_path output/policy.json
+python distill.py --runs output/survival_rate --policy output/policy.json --compare output/distilled --report output/distilled/report.csv
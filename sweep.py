@@ -0,0 +1,172 @@
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from glob import glob
+import pandas as pd
+
+
+def cell_name(decider_type, attacker_num, change_num, seed):
+    return f"{decider_type}-{attacker_num}-{change_num}-seed{seed}"
+
+
+def run_cell(cell, main_argv, cell_dir):
+    # Runs one configuration of the grid in a worker process, its output goes to cell_dir
+    import main
+
+    os.makedirs(cell_dir, exist_ok=True)
+    argv = main_argv + [
+        "--decider_type",
+        cell["decider_type"],
+        "--attacker_num",
+        str(cell["attacker_num"]),
+        "--change_num",
+        str(cell["change_num"]),
+        "--seed",
+        str(cell["seed"]),
+        "--enable_log",
+        "True",
+        "--output_dir",
+        cell_dir,
+    ]
+    with open(os.path.join(cell_dir, "stdout.txt"), "w", encoding="utf-8") as f:
+        with contextlib.redirect_stdout(f), contextlib.redirect_stderr(f):
+            main.run(main.parse_args(argv))
+
+    log_paths = glob(os.path.join(cell_dir, "*", "log", "log.csv"))
+    df = pd.read_csv(max(log_paths, key=os.path.getmtime))
+    result = dict(
+        cell,
+        num_episodes=len(df),
+        survival_rate=df["survival_rate"].mean(),
+        success_rate=df["success_list"].mean(),
+        step_num=df["step_num_list"].mean(),
+        convergence_episode=int(df["convergence_episode"].iloc[0]),
+    )
+    # Written last: a cell with result.json is complete and skipped when the sweep is resumed
+    with open(os.path.join(cell_dir, "result.json"), "w", encoding="utf-8") as f:
+        json.dump(result, f)
+    return result
+
+
+def completed_results(sweep_dir):
+    results = []
+    for result_path in sorted(glob(os.path.join(sweep_dir, "*", "result.json"))):
+        with open(result_path, encoding="utf-8") as f:
+            results.append(json.load(f))
+    return results
+
+
+def sweep(
+    name,
+    decider_types,
+    attacker_nums,
+    change_nums,
+    seeds,
+    main_argv,
+    workers=1,
+    output_dir="output",
+):
+    sweep_dir = os.path.abspath(os.path.join(output_dir, name))
+    results = []
+    pending = {}
+    for decider_type, attacker_num, change_num, seed in itertools.product(
+        decider_types, attacker_nums, change_nums, seeds
+    ):
+        cell = {
+            "decider_type": decider_type,
+            "attacker_num": attacker_num,
+            "change_num": change_num,
+            "seed": seed,
+        }
+        cell_dir = os.path.join(
+            sweep_dir, cell_name(decider_type, attacker_num, change_num, seed)
+        )
+        result_path = os.path.join(cell_dir, "result.json")
+        if os.path.exists(result_path):
+            with open(result_path, encoding="utf-8") as f:
+                results.append(json.load(f))
+        else:
+            pending[cell_dir] = cell
+    print(
+        f"Sweep {name}: {len(results)} cells done, {len(pending)} cells to run with {workers} workers"
+    )
+
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(run_cell, cell, main_argv, cell_dir): cell_dir
+            for cell_dir, cell in pending.items()
+        }
+        for future in as_completed(futures):
+            cell_dir = futures[future]
+            try:
+                results.append(future.result())
+                print(f"done {os.path.basename(cell_dir)}")
+            except Exception:
+                failed.append(cell_dir)
+                print(f"failed {os.path.basename(cell_dir)}\n{traceback.format_exc()}")
+
+    # Every completed cell of the sweep directory, also those of earlier grids run under the same name
+    summary = pd.DataFrame(completed_results(sweep_dir))
+    if len(summary):
+        summary = summary.sort_values(
+            ["decider_type", "attacker_num", "change_num", "seed"]
+        )
+    summary.to_csv(os.path.join(sweep_dir, "summary.csv"), index=False)
+    print(summary.to_string(index=False))
+    if failed:
+        print(
+            f"{len(failed)} cells failed and will be run again when the sweep is resumed"
+        )
+    return summary, failed
+
+
+if __name__ == "__main__":
+    # Grid options are parsed here, all other options are passed to every run of main.py
+    parser = argparse.ArgumentParser(description="argparse")
+    parser.add_argument("--name", type=str, required=True, help="Name of the sweep")
+    parser.add_argument(
+        "--decider_types", type=str, nargs="+", required=True, help="Deciders"
+    )
+    parser.add_argument(
+        "--attacker_nums", type=int, nargs="+", required=True, help="Attacker numbers"
+    )
+    parser.add_argument(
+        "--change_nums",
+        type=int,
+        nargs="+",
+        required=False,
+        default=[0],
+        help="Changed attacker numbers",
+    )
+    parser.add_argument(
+        "--seeds", type=int, nargs="+", required=False, default=[0], help="Seeds"
+    )
+    parser.add_argument(
+        "--workers", type=int, required=False, default=1, help="Number of processes"
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        required=False,
+        default="output",
+        help="Directory of the sweeps",
+    )
+
+    args, main_argv = parser.parse_known_args()
+    _, failed = sweep(
+        args.name,
+        args.decider_types,
+        args.attacker_nums,
+        args.change_nums,
+        args.seeds,
+        main_argv,
+        workers=args.workers,
+        output_dir=args.output_dir,
+    )
+    if failed:
+        raise SystemExit(1)
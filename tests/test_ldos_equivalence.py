@@ -0,0 +1,53 @@
+from argparse import Namespace
+import numpy as np
+import pytest
+from constants import AttackerType
+from env import Env
+from utils import get_action_thresholds
+
+BOOKKEEPING = ["port_list", "add_ser_list1", "add_ser_list2", "del_ser_list"]
+
+
+def new_env(vectorized, port_seed):
+    env = Env(
+        Namespace(
+            attacker_type=AttackerType.LDOS,
+            attacker_num=50,
+            port_seed=port_seed,
+            port_reuse_window=0,
+        )
+    )
+    env.attacker.vectorized = vectorized
+    return env
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_step_batch_matches_step_loop(seed):
+    # The same defence sequence through LDoSAttacker.step_batch and the original step_loop
+    rng = np.random.RandomState(seed)
+    envs = [new_env(True, seed), new_env(False, seed)]
+    np.random.seed(seed)
+    random_state = np.random.get_state()
+    for env in envs:
+        np.random.set_state(random_state)
+        env.reset()
+    action_thresholds = get_action_thresholds(AttackerType.LDOS)
+    for step in range(40):
+        action = int(rng.randint(6))
+        con_percent, mem_percent = action_thresholds[action]
+        do_attack = bool(rng.rand() < 0.9)
+        random_state = np.random.get_state()
+        for env in envs:
+            np.random.set_state(random_state)
+            env.step(
+                action,
+                {"con_percent": con_percent, "mem_percent": mem_percent},
+                do_attack,
+            )
+        batch, loop = envs
+        message = f"seed {seed} step {step} action {action}"
+        np.testing.assert_array_equal(batch.state, loop.state, message)
+        np.testing.assert_array_equal(batch.attack_state, loop.attack_state, message)
+        for key in BOOKKEEPING:
+            assert list(getattr(batch, key)) == list(getattr(loop, key)), message
+        assert batch.attacker.save() == loop.attacker.save(), message
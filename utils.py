@@ -26,3 +26,13 @@ def judge_fail_func(indicators):
         success = True
         fail_msg = None
     return success, fail_msg
+
+
+def judge_fail_batch(indicators):
+    # The success flags of judge_fail_func for an IndicatorsBatch
+    return ~(
+        (indicators.C_d > 0)
+        | (indicators.M_d > 0)
+        | (indicators.con_delay > 0.8)
+        | (indicators.mem_delay > 0.8)
+    )
@@ -0,0 +1,335 @@
+import numpy as np
+from gymnasium.vector import VectorEnv as GymVectorEnv, AutoresetMode
+from gymnasium.vector.utils import batch_space
+from env import Env
+from port_pool import PortPool
+from constants import map_action_to_defence
+from utils import get_action_thresholds, judge_fail_func
+
+
+class VectorEnv(GymVectorEnv):
+    """
+    N independent clusters kept in batched arrays and stepped together.
+    Each sub-environment follows its own attack sequence and is reset automatically
+    in the same step its episode ends; the last observation is returned in infos["final_obs"].
+    """
+
+    metadata = {"autoreset_mode": AutoresetMode.SAME_STEP}
+
+    def __init__(
+        self,
+        args,
+        num_envs,
+        attack_sequences,
+        max_fail_num=5,
+        max_episode_step=30,
+        action_thresholds=None,
+    ):
+        self.num_envs = num_envs
+        self.max_fail_num = max_fail_num
+        self.max_episode_step = max_episode_step
+
+        # Worker environment: holds the cluster constants, the defender and the attacker,
+        # and is loaded with one cluster of the batch at a time
+        self.env = Env(args)
+        # Every cluster draws its service ports from its own pool, seeded like the concurrent runs of main.py
+        port_seed = getattr(args, "port_seed", None)
+        self.port_pools = [
+            PortPool(
+                reuse_window=self.env.port_pool.reuse_window,
+                seed=None if port_seed is None else port_seed + i,
+                rng=self.env.rng,
+            )
+            for i in range(num_envs)
+        ]
+        self.ser_max_num = self.env.ser_max_num
+        self.ser_ind = self.env.ser_ind
+
+        self.single_observation_space = self.env.observation_space
+        self.single_action_space = self.env.action_space
+        self.observation_space = batch_space(self.single_observation_space, num_envs)
+        self.action_space = batch_space(self.single_action_space, num_envs)
+
+        # A single attack sequence is shared by all clusters
+        if len(attack_sequences) > 0 and not isinstance(
+            attack_sequences[0], (list, tuple, np.ndarray)
+        ):
+            attack_sequences = [attack_sequences] * num_envs
+        assert (
+            len(attack_sequences) == num_envs
+        ), "One attack sequence is required per environment."
+        self.attack_sequences = [list(seq) for seq in attack_sequences]
+
+        self.action_thresholds = (
+            action_thresholds
+            if action_thresholds is not None
+            else get_action_thresholds(self.env.attacker.type)
+        )
+
+        # batched service status, attack status and per-cluster counters
+        self.state = np.zeros(
+            (num_envs, self.ser_max_num, self.ser_ind), dtype=np.int64
+        )
+        self.attack_state = np.zeros((num_envs, self.ser_max_num, 6), dtype=np.int64)
+        self.ser_num = np.zeros(num_envs, dtype=np.int64)
+        self.con_remain = np.zeros(num_envs, dtype=np.int64)
+        self.mem_remain = np.zeros(num_envs, dtype=np.int64)
+
+        self.step_num = np.zeros(
+            num_envs, dtype=np.int64
+        )  # steps in the current episode
+        self.success_num = np.zeros(num_envs, dtype=np.int64)  # consecutive successes
+        self.fail_num = np.zeros(num_envs, dtype=np.int64)  # consecutive failures
+        self.success_steps = np.zeros(num_envs, dtype=np.int64)  # successful steps
+
+    @property
+    def attacker(self):
+        return self.env.attacker
+
+    def _load(self, i):
+        self.env.state = self.state[i]
+        self.env.attack_state = self.attack_state[i]
+        self.env.state_index.rebuild(self.env.state[:, 2])
+        self.env.attack_index.rebuild(self.env.attack_state[:, 0])
+        self.env.ser_num = int(self.ser_num[i])
+        self.env.steps_beyond_terminated = 0
+        self.env.attacker.con_remain = self.con_remain[i]
+        self.env.attacker.mem_remain = self.mem_remain[i]
+        self.env.port_pool = self.port_pools[i]
+
+    def _store(self, i):
+        self.state[i] = self.env.state
+        self.attack_state[i] = self.env.attack_state
+        self.ser_num[i] = self.env.ser_num
+        self.con_remain[i] = self.env.attacker.con_remain
+        self.mem_remain[i] = self.env.attacker.mem_remain
+
+    def _do_attack(self):
+        return np.array(
+            [
+                sequence[self.step_num[i] % len(sequence)]
+                for i, sequence in enumerate(self.attack_sequences)
+            ],
+            dtype=bool,
+        )
+
+    def _silent(self, i):
+        # Silent for one round, no attack: normal user traffic, clear attack traffic
+        self._load(i)
+        self.env.state = np.zeros((self.ser_max_num, self.ser_ind), dtype=np.int64)
+        self.env.state_index.clear()
+        self.env.port_pool.reset()
+        self.env.attacker.reset()
+        self.env.defender.reset()
+        self._store(i)
+
+    def _reset_envs(self, mask):
+        for i in np.flatnonzero(mask):
+            self.env.port_pool = self.port_pools[i]
+            self.env.reset()
+            self._store(i)
+        self.step_num[mask] = 0
+        self.success_num[mask] = 0
+        self.fail_num[mask] = 0
+        self.success_steps[mask] = 0
+
+    def reset(self, *, seed=None, options=None):
+        if seed is not None:
+            self.env.rng.seed(seed)
+            for i, pool in enumerate(self.port_pools):
+                pool.seed(seed + i)
+        self._reset_envs(np.ones(self.num_envs, dtype=bool))
+        return self.state.copy(), {}
+
+    def step(self, actions):
+        actions = np.asarray(actions, dtype=np.int64).reshape(self.num_envs)
+        assert self.action_space.contains(actions), f"{actions!r} invalid"
+
+        defence_success = np.zeros(self.num_envs, dtype=bool)
+        defence_cost = np.zeros(self.num_envs, dtype=np.int64)
+        defence_fail_msgs = np.empty(self.num_envs, dtype=object)
+        success = np.zeros(self.num_envs, dtype=bool)
+        rewards = np.zeros(self.num_envs, dtype=np.float64)
+        fail_msgs = np.empty(self.num_envs, dtype=object)
+
+        do_attack = self._do_attack()
+        pod_remain = self.env.pod_max_num - np.sum(self.state[:, :, 0], axis=1)
+
+        # Clusters that chose the same action are defended together
+        ports = {}
+        for action in np.unique(actions):
+            idx = np.flatnonzero(actions == action)
+            con_percent, mem_percent = self.action_thresholds[action]
+            state = self.state[idx]
+            ser_num = self.ser_num[idx]
+            group_pod_remain = pod_remain[idx]
+            success_idx, fail_msgs_idx, cost_idx, ports_idx = (
+                self.env.defender.step_batch(
+                    map_action_to_defence[action],
+                    {"con_percent": con_percent, "mem_percent": mem_percent},
+                    state,
+                    self.attack_state[idx],
+                    ser_num,
+                    group_pod_remain,
+                    [self.port_pools[i] for i in idx],
+                )
+            )
+            self.state[idx] = state
+            self.ser_num[idx] = ser_num
+            pod_remain[idx] = group_pod_remain
+            defence_success[idx] = success_idx
+            defence_cost[idx] = cost_idx
+            defence_fail_msgs[idx] = fail_msgs_idx
+            for key, value in ports_idx.items():
+                ports.setdefault(key, np.zeros_like(self.state[:, :, 0]))[idx] = value
+
+        defence_state = self.state.copy()  # The service status after defense
+
+        # Input attack traffic and execute attack strategy according to defense strategy
+        idx = np.flatnonzero(do_attack)
+        state = self.state[idx]
+        attack_state = self.attack_state[idx]
+        con_remain = self.con_remain[idx]
+        mem_remain = self.mem_remain[idx]
+        self.env.attacker.step_batch(
+            state,
+            attack_state,
+            con_remain,
+            mem_remain,
+            {key: value[idx] for key, value in ports.items()},
+            self.ser_num[idx],
+        )
+        self.state[idx] = state
+        self.attack_state[idx] = attack_state
+        self.con_remain[idx] = con_remain
+        self.mem_remain[idx] = mem_remain
+
+        for i in np.flatnonzero(~do_attack):
+            self._silent(i)
+        if self.env.debug:
+            for i, pool in enumerate(self.port_pools):
+                pool.validate(self.state[i, :, 2])
+
+        indicators = self.env.cal_indicators_batch(
+            defence_state, defence_cost, ser_num=self.ser_num
+        )
+        for i in range(self.num_envs):
+            defence_indicators = indicators[i]
+            success[i], fail_msgs[i] = judge_fail_func(defence_indicators)
+            if success[i]:
+                self.fail_num[i] = 0
+                self.success_num[i] += 1
+            else:
+                self.success_num[i] = 0
+                self.fail_num[i] += 1
+            rewards[i] = self.env.cal_reward(
+                success[i],
+                defence_success[i],
+                defence_indicators,
+                self.success_num[i],
+                self.fail_num[i],
+            )
+
+        self.step_num += 1
+        self.success_steps += success
+
+        # Same end conditions as the deciders: max_fail_num consecutive successes or failures,
+        # and reaching max_episode_step counts as a failed episode
+        finish = (self.success_num >= self.max_fail_num) | (
+            self.fail_num >= self.max_fail_num
+        )
+        truncations = self.step_num >= self.max_episode_step
+        terminations = finish & ~truncations
+        done = terminations | truncations
+
+        infos = {
+            "defence_state": defence_state,
+            "defence_success": defence_success,
+            "defence_fail_msg": defence_fail_msgs,
+            "defence_cost": defence_cost,
+            "success": success,
+            "fail_msg": fail_msgs,
+            "indicators": indicators,
+        }
+
+        if np.any(done):
+            infos["episode"] = {
+                "success": terminations & (self.success_num >= self.max_fail_num),
+                "step_num": self.step_num.copy(),
+                "survival_rate": self.success_steps / self.step_num,
+            }
+            infos["_episode"] = done
+            infos["final_obs"] = self.state.copy()
+            infos["_final_obs"] = done
+            self._reset_envs(done)
+
+        return self.state.copy(), rewards, terminations, truncations, infos
+
+    def evaluate_actions(self):
+        """
+        Defence outcome of every action for every cluster, without changing the batch.
+        Returns the defence states, success flags, costs and indicators with shape (num_envs, defence_num, ...).
+        """
+        n, k = self.num_envs, self.env.defence_num
+        pod_remain = self.env.pod_max_num - np.sum(self.state[:, :, 0], axis=1)
+        defence_states = np.repeat(self.state[:, np.newaxis], k, axis=1)
+        ser_num = np.repeat(self.ser_num[:, np.newaxis], k, axis=1)
+        defence_success = np.zeros((n, k), dtype=bool)
+        defence_costs = np.zeros((n, k), dtype=np.int64)
+
+        random_state = self.env.rng.get_state()
+        for action in range(k):
+            con_percent, mem_percent = self.action_thresholds[action]
+            for pool in self.port_pools:
+                pool.begin()
+            state = self.state.copy()
+            action_ser_num = self.ser_num.copy()
+            success, _, costs, _ = self.env.defender.step_batch(
+                map_action_to_defence[action],
+                {"con_percent": con_percent, "mem_percent": mem_percent},
+                state,
+                self.attack_state,
+                action_ser_num,
+                pod_remain.copy(),
+                self.port_pools,
+            )
+            for pool in self.port_pools:
+                pool.rollback()
+            defence_states[:, action] = state
+            ser_num[:, action] = action_ser_num
+            defence_success[:, action] = success
+            defence_costs[:, action] = costs
+
+        # Clusters that are silent in this round start over as in step, like in Env.evaluate_actions,
+        # and their indicators count the replicas they start over with
+        for i in np.flatnonzero(~self._do_attack()):
+            saved = (
+                self.state[i].copy(),
+                self.attack_state[i].copy(),
+                self.ser_num[i],
+                self.con_remain[i],
+                self.mem_remain[i],
+            )
+            saved_pool = self.port_pools[i].save()
+            self._silent(i)
+            ser_num[i] = self.ser_num[i]
+            self.port_pools[i].load(saved_pool)
+            (
+                self.state[i],
+                self.attack_state[i],
+                self.ser_num[i],
+                self.con_remain[i],
+                self.mem_remain[i],
+            ) = saved
+        self.env.rng.set_state(random_state)
+
+        indicators = self.env.cal_indicators_batch(
+            defence_states, defence_costs, ser_num=ser_num
+        )
+        return defence_states, defence_success, defence_costs, indicators
+
+    def change_attacker_num(self, num):
+        if self.env.attacker.num == num:
+            return
+        self.env.change_attacker_num(num)
+        self.reset()